@@ -1,54 +1,177 @@
 # -*- coding: utf-8 -*-
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
+"""
+Symmetrical uncertainty kernel
+
+Every column is integer-coded once (np.unique) and its entropy is taken from a
+np.bincount of the codes. The joint entropy of two coded columns comes from the
+histogram of the combined code cx*ny + cy: a dense bincount when the joint
+table is small, the counts of np.unique otherwise. SU(x, y) then only needs
+H(x,y), because H(x|y) = H(x,y) - H(y).
+"""
+
+def encode(x):
+    vals, codes = np.unique(x, return_inverse = True)
+    return codes.reshape(-1).astype('int64'), vals.size
+
+def entropy_counts(counts, n):
+    p = counts[counts > 0] / float(n)
+    return -1* np.sum(p*np.log2(p))
+
+def joint_entropy(cx, nx, cy, ny):
+    n = cx.shape[0]
+    key = cx*ny + cy
+    if nx*ny <= 4*n + 1024:
+        counts = np.bincount(key, minlength = nx*ny)
+    else:
+        counts = np.unique(key, return_counts = True)[1]
+    return entropy_counts(counts, n)
+
+def su_coded(cx, nx, hx, cy, ny, hy):
+    hxy = joint_entropy(cx, nx, cy, ny)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return 2*(hx + hy - hxy)/(hx + hy)
+
 def count_vals(x):
-    vals = np.unique(x)
-    occ = np.zeros(shape = vals.shape)    
-    for i in range(vals.size):
-        occ[i] = np.sum(x == vals[i])
-    return occ
+    return np.unique(x, return_counts = True)[1].astype('float64')
 
 def entropy(x):
-    n = float(x.shape[0])
-    ocurrence = count_vals(x)
-    px = ocurrence / n
-    return -1* np.sum(px*np.log2(px))
+    return entropy_counts(count_vals(x), x.shape[0])
 
 def symmetricalUncertain(x,y):
-    n = float(y.shape[0])
-    vals = np.unique(y)
-    # Computing Entropy for the feature x. 
-    Hx = entropy(x)
-    # Computing Entropy for the feature y.
-    Hy = entropy(y)
-    #Computing Joint entropy between x and y.
-    partial = np.zeros(shape = (vals.shape[0]))
-    for i in range(vals.shape[0]):    
-       partial[i] = entropy(x[y == vals[i]]) 
-    
-    partial[np.isnan(partial)==1] = 0      
-    py = count_vals(y).astype(dtype = 'float64') / n
-    Hxy = np.sum(py[py > 0]*partial) 
-    IG = Hx-Hxy
-    return 2*IG/(Hx+Hy)
+    cx, nx = encode(x)
+    cy, ny = encode(y)
+    hx = entropy_counts(np.bincount(cx), cx.shape[0])
+    hy = entropy_counts(np.bincount(cy), cy.shape[0])
+    return su_coded(cx, nx, hx, cy, ny, hy)
 
-def suGroup(x, n):
-    m = x.shape[0]
-    x = np.reshape(x, (n,m/n)).T
-    m = x.shape[1]
-    SU_matrix = np.zeros(shape = (m,m))
-    for j in range(m-1):
-        x2 = x[:,j+1::]
-        y = x[:,j]
-        temp = np.apply_along_axis(symmetricalUncertain, 0, x2, y)
-        for k in range(temp.shape[0]):
+
+"""
+SU evaluations run on a shared thread pool: the coded columns are read-only
+numpy arrays, and the sorts/bincounts in the kernel release the GIL. Small
+batches are computed inline, where dispatching would cost more than it saves.
+"""
+
+PARALLEL_MIN_CELLS = 200000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def n_workers(n_jobs):
+    if n_jobs is None or n_jobs < 0:
+        return os.cpu_count() or 1
+    return max(1, n_jobs)
+
+def parallel_map(fn, items, n_jobs = -1, cells = 0):
+    global _pool
+    items = list(items)
+    workers = n_workers(n_jobs)
+    if workers == 1 or len(items) < 2 or cells < PARALLEL_MIN_CELLS:
+        return [fn(i) for i in items]
+    with _pool_lock:
+        if _pool is None or _pool._max_workers < workers:
+            # the smaller pool's threads finish the maps already submitted to it, then exit
+            if _pool is not None:
+                _pool.shutdown(wait = False)
+            _pool = ThreadPoolExecutor(max_workers = workers)
+        pool = _pool
+    return list(pool.map(fn, items))
+
+
+class SUTable:
+    """
+    The columns of x integer-coded, with their entropies (computed once)
+    """
+
+    def __init__(self, x, n_jobs = -1):
+        x = np.asarray(x)
+        self.n, self.m = x.shape
+        self.n_jobs = n_jobs
+        self.codes = np.zeros(shape = (self.m, self.n), dtype = 'int64')
+        self.nvals = np.zeros(shape = self.m, dtype = 'int64')
+        self.H = np.zeros(shape = self.m)
+
+        def code(j):
+            self.codes[j], self.nvals[j] = encode(x[:,j])
+            self.H[j] = entropy_counts(np.bincount(self.codes[j]), self.n)
+        parallel_map(code, range(self.m), n_jobs, self.n*self.m)
+
+    def su(self, j, cy, ny, hy):
+        return su_coded(self.codes[j], self.nvals[j], self.H[j], cy, ny, hy)
+
+    def su_target(self, y):
+        '''
+        SU of every column with the label vector y
+        '''
+        cy, ny = encode(y)
+        hy = entropy_counts(np.bincount(cy), self.n)
+        return np.array(parallel_map(lambda j: self.su(j, cy, ny, hy), range(self.m), self.n_jobs, self.n*self.m))
+
+    def su_pairs(self, i, cols):
+        '''
+        SU of column i with each of the columns cols
+        '''
+        cols = list(cols)
+        return np.array(parallel_map(lambda c: self.su(c, self.codes[i], self.nvals[i], self.H[i]),
+                                     cols, self.n_jobs, self.n*len(cols)))
+
+    def su_block(self, i, cols):
+        '''
+        SU of column i with each of the columns cols, vectorized over the
+        pairs: the joint codes of all pairs are offset into one range and
+        counted together, and the joint entropies are summed per pair
+        '''
+        cols = np.asarray(cols, dtype = 'int64')
+        sizes = self.nvals[i]*self.nvals[cols]
+        offsets = np.cumsum(sizes) - sizes
+        keys = self.codes[i]*self.nvals[cols][:,None] + self.codes[cols] + offsets[:,None]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            if sizes.sum() <= 4*keys.size + 1024:
+                p = np.bincount(keys.ravel(), minlength = sizes.sum()) / float(self.n)
+                hxy = -1*np.add.reduceat(np.where(p > 0, p*np.log2(p), 0), offsets)
+            else:
+                keys, counts = np.unique(keys, return_counts = True)
+                p = counts / float(self.n)
+                pair = np.searchsorted(offsets, keys, side = 'right') - 1
+                hxy = -1*np.bincount(pair, weights = p*np.log2(p), minlength = cols.size)
+            return 2*(self.H[i] + self.H[cols] - hxy)/(self.H[i] + self.H[cols])
+
+    def mean_su(self, cols):
+        '''
+        Mean SU of each of the columns cols with the other ones
+        (nan for a single column)
+        '''
+        m = len(cols)
+        SU_matrix = np.zeros(shape = (m,m))
+        for j in range(m-1):
+            temp = self.su_block(cols[j], cols[j+1:])
             SU_matrix[j,j+1::] = temp
             SU_matrix[j+1::,j] = temp
-    
-    return 1/float(m-1)*np.sum(SU_matrix, axis = 1)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return np.sum(SU_matrix, axis = 1) / float(m-1) if m > 1 else np.full(m, np.nan)
+
+    def ranked(self, y, th):
+        '''
+        Indexes of the columns with SU > th with the label, by decreasing SU
+        (ties in column order), and their SU values
+        '''
+        SU_vec = self.su_target(y)
+        order = np.array([i for i in np.argsort(-SU_vec, kind = 'stable') if SU_vec[i] > th], dtype = 'int64')
+        return order, SU_vec[order]
+
+
+def suGroup(x, n):
+    m = x.shape[0]
+    x = np.reshape(x, (n,m//n)).T
+    return SUTable(x, 1).mean_su(np.arange(n))
 
 def isprime(a):
-    return all(a % i for i in xrange(2, a))
+    return all(a % i for i in range(2, a))
 
 
 """
@@ -58,7 +181,7 @@ get
 def get_i(a):
     if isprime(a):
         a -= 1
-    return filter(lambda x: a % x == 0, range(2,a))
+    return [x for x in range(2,a) if a % x == 0]
 
 
 """
@@ -74,13 +197,16 @@ class FCBF:
     idx_sel = []
     
     
-    def __init__(self, th = 0.01):
+    def __init__(self, th = 0.01, n_jobs = -1):
         '''
         Parameters
         ---------------
             th = The initial threshold 
+            n_jobs = Number of threads for the SU evaluations
+            (-1: one per CPU)
         '''
         self.th = th
+        self.n_jobs = n_jobs
 
 
     def fit(self, x, y):
@@ -93,50 +219,29 @@ class FCBF:
             x = dataset  [NxM] 
             y = label    [Nx1]
         '''
-        self.idx_sel = []
         """
         First Stage: Computing the SU for each feature with the response.
         """
-        SU_vec = np.apply_along_axis(symmetricalUncertain, 0, x, y)
-        SU_list = SU_vec[SU_vec > self.th]
-        SU_list[::-1].sort()
-        
-        m = x[:,SU_vec > self.th].shape
-        x_sorted = np.zeros(shape = m)
-        
-        for i in range(m[1]):
-            ind = np.argmax(SU_vec)
-            SU_vec[ind] = 0
-            x_sorted[:,i] = x[:,ind].copy()
-            self.idx_sel.append(ind)
+        table = SUTable(x, self.n_jobs)
+        order, SU_list = table.ranked(y, self.th)
         
         """
         Second Stage: Identify relationships between feature to remove redundancy.
+        Removed features are switched off in the active mask; the columns never move.
         """
-        j = 0
-        while True:
+        active = np.ones(shape = order.shape, dtype = bool)
+        for j in range(order.shape[0]):
+            if not active[j]: continue
+            rest = np.flatnonzero(active[j+1:]) + j + 1
             """
             Stopping Criteria:The search finishes
             """
-            if j >= x_sorted.shape[1]: break
-            y = x_sorted[:,j].copy()
-            x_list = x_sorted[:,j+1:].copy()
-            if x_list.shape[1] == 0: break
-                
-                
-            SU_list_2 = SU_list[j+1:]
-            SU_x = np.apply_along_axis(symmetricalUncertain, 0, 
-                                       x_list, y)
+            if rest.size == 0: break
             
-            comp_SU = SU_x >= SU_list_2
-            to_remove = np.where(comp_SU)[0] + j + 1 
-            if to_remove.size > 0:
-                x_sorted = np.delete(x_sorted, to_remove, axis = 1)
-                SU_list = np.delete(SU_list, to_remove, axis = 0)
-                to_remove.sort()
-                for r in reversed(to_remove): 
-                    self.idx_sel.remove(self.idx_sel[r])
-            j = j + 1        
+            SU_x = table.su_pairs(order[j], order[rest])
+            active[rest[SU_x >= SU_list[rest]]] = False
+            
+        self.idx_sel = [int(i) for i in order[active]]
             
     def fit_transform(self, x, y):
         '''
@@ -174,14 +279,17 @@ class FCBFK(FCBF):
     idx_sel = []
     
     
-    def __init__(self, k = 10):
+    def __init__(self, k = 10, n_jobs = -1):
         '''
         Parameters
         ---------------
             k = Number of features to include in the
             subset.
+            n_jobs = Number of threads for the SU evaluations
+            (-1: one per CPU)
         '''
         self.k = k
+        self.n_jobs = n_jobs
 
 
     def fit(self, x, y):
@@ -194,60 +302,40 @@ class FCBFK(FCBF):
             x = dataset  [NxM] 
             y = label    [Nx1]
         '''        
-        self.idx_sel = []
         """
         First Stage: Computing the SU for each feature with the response.
         """    
-        SU_vec = np.apply_along_axis(symmetricalUncertain, 0, x, y)
-        
-        SU_list = SU_vec[SU_vec > 0]
-        SU_list[::-1].sort()
-        
-        m = x[:,SU_vec > 0].shape
-        x_sorted = np.zeros(shape = m)
-        
-        for i in range(m[1]):
-            ind = np.argmax(SU_vec)
-            SU_vec[ind] = 0
-            x_sorted[:,i] = x[:,ind].copy() 
-            self.idx_sel.append(ind)
+        table = SUTable(x, self.n_jobs)
+        order, SU_list = table.ranked(y, 0)
             
         """
         Second Stage: Identify relationships between features to remove redundancy with stopping 
-        criteria (features in x_best == k).
+        criteria (features in x_best == k). Features are removed from the back, one at a time,
+        until k are left.
         """    
-        j = 0
-        while True:
-            y = x_sorted[:,j].copy()
-            SU_list_2 = SU_list[j+1:]    
-            x_list = x_sorted[:,j+1:].copy()
+        active = np.ones(shape = order.shape, dtype = bool)
+        n_active = order.shape[0]
+        for j in range(order.shape[0]):
+            if not active[j]: continue
+            rest = np.flatnonzero(active[j+1:]) + j + 1
             
             """
             Stopping Criteria:The search finishes
             """
-            if x_list.shape[1] == 0: break
+            if rest.size == 0: break
                 
-                
-            SU_x = np.apply_along_axis(symmetricalUncertain, 0, 
-                                       x_list, y)
-            
-            comp_SU = SU_x >= SU_list_2
-            to_remove = np.where(comp_SU)[0] + j + 1 
+            SU_x = table.su_pairs(order[j], order[rest])
+            to_remove = rest[SU_x >= SU_list[rest]]
             if to_remove.size > 0 and x.shape[1] > self.k:
-    
                 for i in reversed(to_remove):
+                    active[i] = False
+                    n_active -= 1
+                    if n_active == self.k: break  
                     
-                    x_sorted = np.delete(x_sorted, i, axis = 1)
-                    SU_list = np.delete(SU_list, i, axis = 0)                
-                    self.idx_sel.remove(self.idx_sel[i])
-                    if x_sorted.shape[1] == self.k: break  
-                    
-            if x_list.shape[1] == 1 or x_sorted.shape[1] == self.k: 
+            if rest.size == 1 or n_active == self.k: 
                 break    
-            j = j + 1
             
-        if len(self.idx_sel) > self.k:
-            self.idx_sel = self.idx_sel[:self.k]
+        self.idx_sel = [int(i) for i in order[active]][:self.k]
             
             
             
@@ -260,7 +348,7 @@ class FCBFiP(FCBF):
     idx_sel = []
 
 
-    def __init__(self, k = 10, npieces = 2):
+    def __init__(self, k = 10, npieces = 2, n_jobs = -1):
         '''
         Parameters
         ---------------
@@ -268,9 +356,12 @@ class FCBFiP(FCBF):
             subset.
             npieces = Number of pieces to divide the 
             feature space.
+            n_jobs = Number of threads the pieces are
+            processed on (-1: one per CPU)
         '''
         self.k = k
         self.npieces = npieces
+        self.n_jobs = n_jobs
 
     def fit(self, x, y):
         '''
@@ -289,63 +380,39 @@ class FCBFiP(FCBF):
         sorted features list.
         """      
         m = x.shape
-        nfeaturesPieces = int(m[1] / float(self.npieces))        
-        SU_vec = np.apply_along_axis(symmetricalUncertain, 0, x, y)
-        
-        x_sorted = np.zeros(shape = m, dtype = 'float64')        
-        idx_sorted = np.zeros(shape = m[1], dtype = 'int64')
-        for i in range(m[1]):
-            ind = np.argmax(SU_vec)
-            SU_vec[ind] = -1
-            idx_sorted[i]= ind 
-            x_sorted[:,i] = x[:,ind].copy() 
+        table = SUTable(x, self.n_jobs)
+        SU_vec = table.su_target(y)
+        idx_sorted = np.argsort(-SU_vec, kind = 'stable')
 
+        ind_prime = None
         if isprime(m[1]): 
-            x_sorted = np.delete(x_sorted, m[1]-1, axis = 1 )
             ind_prime = idx_sorted[m[1]-1]
-            idx_sorted = np.delete(idx_sorted, m[1]-1)
-            #m = x_sorted.shape
+            idx_sorted = idx_sorted[:m[1]-1]
         """
         Second Stage: Identify relationships between features into its vecinity
         to remove redundancy with stopping criteria (features in x_best == k).
+        The sorted features are cut into npieces consecutive pieces (sizes differ by
+        at most one when npieces doesn't divide them), each piece gets its SU matrix and
+        the pieces are processed in parallel.
         """   
-        
-        x_2d = np.reshape(x_sorted.T, (self.npieces, nfeaturesPieces*m[0])).T
-    
-        SU_x =  np.apply_along_axis(suGroup, 0, x_2d, nfeaturesPieces)
-        SU_x = np.reshape(SU_x.T, (self.npieces*nfeaturesPieces,))
-        idx_sorted2 = np.zeros(shape = idx_sorted.shape, dtype = 'int64')
+        pieces = np.array_split(idx_sorted, self.npieces)
+        SU_x = np.concatenate(parallel_map(table.mean_su, pieces, self.n_jobs, m[0]*idx_sorted.shape[0]))
         SU_x[np.isnan(SU_x)] = 1        
-        
-        for i in range(idx_sorted.shape[0]):
-            ind =  np.argmin(SU_x)
-            idx_sorted2[i] = idx_sorted[ind]
-            SU_x[ind] = 10    
+        idx_sorted2 = idx_sorted[np.argsort(SU_x, kind = 'stable')]
         
         """
-        Scoring step
+        Scoring step: position in the SU ranking plus position in the redundancy ranking
         """        
-        self.scores = np.zeros(shape = m[1], dtype = 'int64') 
-           
-        for i in range(m[1]):
-            if i in idx_sorted:
-                self.scores[i] = np.argwhere(i == idx_sorted) + np.argwhere(i == idx_sorted2)
-        if isprime(m[1]): 
+        rank = np.zeros(shape = m[1], dtype = 'int64')
+        rank2 = np.zeros(shape = m[1], dtype = 'int64')
+        rank[idx_sorted] = np.arange(idx_sorted.shape[0])
+        rank2[idx_sorted2] = np.arange(idx_sorted2.shape[0])
+        self.scores = rank + rank2
+        if ind_prime is not None: 
             self.scores[ind_prime] = 2*m[1]
         self.set_k(self.k)
 
 
     def set_k(self, k):
         self.k = k 
-        scores_temp = -1*self.scores
-        
-        self.idx_sel = np.zeros(shape = self.k, dtype = 'int64')
-        for i in range(self.k):
-            ind =  np.argmax(scores_temp)
-            scores_temp[ind] = -100000000
-            self.idx_sel[i] = ind
-
-        
-        
-
-        
\ No newline at end of file
+        self.idx_sel = np.argsort(self.scores, kind = 'stable')[:self.k].astype('int64')
@@ -0,0 +1,107 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import joblib
+
+# Trained LCCDE ensembles are kept on disk under ARTIFACT_DIR/<key>/ where the key is a hash of the
+# dataset contents and the normalized XGB/LightGBM/CatBoost parameters. A later run with the same
+# dataset and parameters loads the learners from here instead of training them again.
+ARTIFACT_DIR = './Backend/artifacts/'
+
+MODELS_FILE = 'models.joblib'
+META_FILE = 'meta.json'
+
+_fingerprints = {}
+_meta_lock = threading.Lock()
+
+#sha256 of the file contents, remembered per (path, size, mtime) so the dataset is only hashed once
+#for a prepared dataset directory (see ingest.py) its meta.json, which lists the source files' hashes, is hashed
+def dataset_fingerprint(path):
+    if os.path.isdir(path):
+        path = os.path.join(path, 'meta.json')
+    stat = os.stat(path)
+    cache_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if cache_key not in _fingerprints:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _fingerprints[cache_key] = h.hexdigest()
+    return _fingerprints[cache_key]
+
+#make equal parameter sets hash the same ("0.1" and 0.1, 100 and 100.0)
+def normalize_value(value):
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def normalize_params(params):
+    return {name: {k: normalize_value(v) for k, v in sorted(p.items())} for name, p in sorted(params.items())}
+
+def artifact_key(fingerprint, params):
+    payload = json.dumps({'dataset': fingerprint, 'params': normalize_params(params)}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def artifact_path(key):
+    return os.path.join(ARTIFACT_DIR, key)
+
+def exists(key):
+    return os.path.isfile(os.path.join(artifact_path(key), META_FILE))
+
+#save the fitted models (dict name -> estimator) plus extra picklable state under the key
+#the directory is written to a temp location first and renamed, so readers never see half an artifact
+def save(key, models, state, meta):
+    if exists(key):
+        return
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=ARTIFACT_DIR)
+    meta = dict(meta, key=key, created=str(datetime.datetime.now()), run_ids=[])
+    joblib.dump({'models': models, 'state': state}, os.path.join(tmp, MODELS_FILE))
+    with open(os.path.join(tmp, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    try:
+        os.rename(tmp, artifact_path(key))
+    except OSError:
+        #another run stored the same artifact first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+#returns (models, state) or None if there is no artifact for the key
+def load(key):
+    if not exists(key):
+        return None
+    content = joblib.load(os.path.join(artifact_path(key), MODELS_FILE))
+    return content['models'], content['state']
+
+def read_meta(key):
+    with open(os.path.join(artifact_path(key), META_FILE)) as f:
+        return json.load(f)
+
+#record that a run (row in the model table) used this artifact
+def link_run(key, run_id):
+    if key is None or not exists(key):
+        return
+    with _meta_lock:
+        meta = read_meta(key)
+        if run_id not in meta['run_ids']:
+            meta['run_ids'].append(run_id)
+        with open(os.path.join(artifact_path(key), META_FILE), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+#find the artifact a given run was linked to
+def find_by_run(run_id):
+    if not os.path.isdir(ARTIFACT_DIR):
+        return None
+    for key in os.listdir(ARTIFACT_DIR):
+        if exists(key) and run_id in read_meta(key)['run_ids']:
+            return key
+    return None
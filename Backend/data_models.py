@@ -85,4 +85,14 @@ class RunHistory(Base):
 
     run_id = Column(Integer, primary_key=True, autoincrement=True)
     duration = Column(Integer, nullable=False)
-    run_date = Column(DateTime, default= datetime.datetime.now())
\ No newline at end of file
+    run_date = Column(DateTime, default= datetime.datetime.now())
+
+# Time spent in each pipeline stage of a run (ingest, normalize, feature selection, resample, fits, HPO, ...)
+class RunStages(Base):
+    __tablename__ = 'RunStages'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(Integer)
+    model = Column(String)
+    stage = Column(String)
+    seconds = Column(FLOAT)
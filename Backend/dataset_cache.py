@@ -0,0 +1,135 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+from artifact_store import dataset_fingerprint
+
+# Binary copies of the dataset CSVs. The first load of a CSV parses it once and writes every column
+# to its own .npy file under CACHE_DIR/<sha256 of the csv>/; later loads memory-map those files
+# (copy-on-write, so pipelines can modify the frame without touching the cache) and skip parsing.
+# String columns (the Label column) are stored as integer codes plus the list of categories.
+# When a CSV changes, the index entry and the columns of its previous version are deleted.
+CACHE_DIR = './Backend/dataset_cache/'
+
+META_FILE = 'meta.json'
+INDEX_FILE = 'index.json'
+
+_index_lock = threading.Lock()
+
+def cache_path(fingerprint):
+    return os.path.join(CACHE_DIR, fingerprint)
+
+def exists(fingerprint):
+    return os.path.isfile(os.path.join(cache_path(fingerprint), META_FILE))
+
+#(path, size, mtime) -> fingerprint, kept on disk so a restarted server doesn't have to hash the csv again
+def _stat_key(path):
+    stat = os.stat(path)
+    return '|'.join([os.path.abspath(path), str(stat.st_size), str(stat.st_mtime_ns)])
+
+def _read_index():
+    try:
+        with open(os.path.join(CACHE_DIR, INDEX_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+#the fingerprint of the csv if it was already hashed in its current version, else None (never reads the csv)
+def known_fingerprint(path):
+    return _read_index().get(_stat_key(path))
+
+def fingerprint(path):
+    key = _stat_key(path)
+    known = _read_index().get(key)
+    if known is not None:
+        return known
+    fp = dataset_fingerprint(path)
+    with _index_lock:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        index = _read_index()
+        # entries of earlier versions of this file are superseded; their columns go too unless another
+        # entry (e.g. a copy of the old file) still points at them
+        source = key.rsplit('|', 2)[0]
+        old = [k for k in index if k.rsplit('|', 2)[0] == source]
+        stale = {index.pop(k) for k in old}
+        index[key] = fp
+        for old_fp in stale - set(index.values()):
+            shutil.rmtree(cache_path(old_fp), ignore_errors=True)
+        tmp = os.path.join(CACHE_DIR, INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, os.path.join(CACHE_DIR, INDEX_FILE))
+    return fp
+
+#one .npy per column of df in directory; returns the column entries for meta.json
+def write_columns(df, directory):
+    columns = []
+    for i, name in enumerate(df.columns):
+        col = df[name]
+        entry = {'name': name, 'file': 'c' + str(i) + '.npy', 'dtype': str(col.dtype)}
+        if col.dtype == object:
+            codes, categories = pd.factorize(col)
+            entry['categories'] = [str(c) for c in categories]
+            values = codes.astype(np.int32)
+        else:
+            values = col.to_numpy()
+        np.save(os.path.join(directory, entry['file']), values)
+        columns.append(entry)
+    return columns
+
+#parse the csv and write one .npy per column; written to a temp directory and renamed into place
+def convert(path, fp):
+    df = pd.read_csv(path)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=CACHE_DIR)
+    columns = write_columns(df, tmp)
+
+    meta = {'source': os.path.abspath(path), 'fingerprint': fp, 'rows': len(df),
+            'columns': columns, 'created': str(datetime.datetime.now())}
+    with open(os.path.join(tmp, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    try:
+        os.rename(tmp, cache_path(fp))
+    except OSError:
+        #converted by a concurrent request in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def read_meta(fp):
+    with open(os.path.join(cache_path(fp), META_FILE)) as f:
+        return json.load(f)
+
+#a directory with meta.json and one .npy per column, e.g. written by ingest.py
+def is_prepared(path):
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, META_FILE))
+
+#memory-map a directory in the cache layout as a frame
+def load_dir(directory):
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = json.load(f)
+
+    data = {}
+    for entry in meta['columns']:
+        values = np.load(os.path.join(directory, entry['file']), mmap_mode='c')
+        if 'categories' in entry:
+            categories = np.asarray(entry['categories'] + [np.nan], dtype=object)
+            #code -1 (missing) picks the trailing nan
+            values = categories[values]
+        data[entry['name']] = values
+    # copy=False keeps one block per column, so numeric columns stay views of the memory-mapped files
+    return pd.DataFrame(data, copy=False)
+
+#drop-in replacement for pd.read_csv(path): same columns, dtypes and values
+#path can also be a prepared directory, which is loaded as it is
+def load(path):
+    if is_prepared(path):
+        return load_dir(path)
+    fp = fingerprint(path)
+    if not exists(fp):
+        convert(path, fp)
+    return load_dir(cache_path(fp))
@@ -0,0 +1,195 @@
+import datetime
+import json
+import os
+import threading
+
+import numpy as np
+
+import dataset_cache
+from artifact_store import dataset_fingerprint
+
+# Datasets the models can run on, and how each one has to be prepared. The model files look the
+# dataset up here instead of checking the file name:
+# - label:         name of the label column
+# - classes:       class names in label-code order, for datasets whose labels are already integer codes
+# - normalize:     min-max normalize the features (False if that was done when the file was made)
+# - encode_labels: label-encode string labels
+# - smote:         SMOTE sampling_strategy for the training split ({class code: target count}), None to skip
+# - stratify:      stratify the train/test split by label
+# Each dataset also gets a profile (rows, class histogram, per-column stats). It is computed when the
+# server starts (profile_all), stored under PROFILE_DIR and reused until the file changes. GET /datasets
+# only reads stored profiles and never the data: a dataset without an up-to-date profile lists None.
+DATA_DIR = './Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/'
+PROFILE_DIR = os.path.join(dataset_cache.CACHE_DIR, 'profiles')
+
+CICIDS2017_CLASSES = ['BENIGN', 'Bot', 'BruteForce', 'DoS', 'Infiltration', 'PortScan', 'WebAttack']
+
+
+class Dataset:
+
+    def __init__(self, name, file, label='Label', classes=None, normalize=True, encode_labels=True, smote=None, stratify=True, description=''):
+        self.name = name
+        self.file = file
+        self.label = label
+        self.classes = classes
+        self.normalize = normalize
+        self.encode_labels = encode_labels
+        self.smote = smote
+        self.stratify = stratify
+        self.description = description
+
+    @property
+    def path(self):
+        return os.path.join(DATA_DIR, self.file)
+
+    def available(self):
+        return os.path.exists(self.path)
+
+    #compute=False gives None for a csv that hasn't been hashed in its current version
+    def fingerprint(self, compute=True):
+        if dataset_cache.is_prepared(self.path):
+            return dataset_fingerprint(self.path)
+        if not compute:
+            return dataset_cache.known_fingerprint(self.path)
+        return dataset_cache.fingerprint(self.path)
+
+    #minima/maxima the features were scaled with when the dataset was prepared (ingest.py), else None
+    def scaling(self):
+        if not dataset_cache.is_prepared(self.path):
+            return None
+        with open(os.path.join(self.path, dataset_cache.META_FILE)) as f:
+            meta = json.load(f)
+        if 'min' not in meta:
+            return None
+        return np.asarray(meta['min'], dtype=float), np.asarray(meta['max'], dtype=float)
+
+    def as_dict(self):
+        return {'name': self.name, 'file': self.file, 'label': self.label, 'classes': self.classes,
+                'normalize': self.normalize, 'encode_labels': self.encode_labels,
+                'smote': self.smote, 'stratify': self.stratify, 'description': self.description, 'available': self.available()}
+
+
+REGISTRY = {}
+_profiles = {}
+_profile_lock = threading.Lock()
+
+def register(dataset, profile=True):
+    REGISTRY[dataset.file] = dataset
+    if profile and dataset.available():
+        get_profile(dataset)
+    return dataset
+
+register(Dataset('CICIDS2017 sample', 'CICIDS2017_sample.csv',
+                 normalize=True, encode_labels=True, smote={4: 1500},
+                 description='Randomly sampled subset of CICIDS2017, raw features and string labels'), profile=False)
+register(Dataset('CICIDS2017 k-means sample', 'CICIDS2017_sample_km.csv', classes=CICIDS2017_CLASSES,
+                 normalize=False, encode_labels=False, smote={2: 1000, 4: 1000}, stratify=False,
+                 description='Subset of CICIDS2017 sampled by k-means clustering, already normalized and label-encoded'), profile=False)
+register(Dataset('CICIDS2017 full', 'CICIDS2017_full',
+                 normalize=False, encode_labels=True, smote={4: 1500},
+                 description='Full CICIDS2017 corpus prepared by ingest.py (normalized, seven classes)'), profile=False)
+
+#prepared directories in DATA_DIR that were not declared above (e.g. ingest.py run with another --out,
+#or a reduction written by kmeans_sampling.py, which stores its registry settings in meta.json)
+def discover():
+    if not os.path.isdir(DATA_DIR):
+        return
+    for entry in sorted(os.listdir(DATA_DIR)):
+        path = os.path.join(DATA_DIR, entry)
+        if entry in REGISTRY or not dataset_cache.is_prepared(path):
+            continue
+        with open(os.path.join(path, dataset_cache.META_FILE)) as f:
+            settings = json.load(f).get('dataset')
+        if settings is not None:
+            if settings.get('smote'):
+                # json turned the class codes into strings
+                settings['smote'] = {int(k): v for k, v in settings['smote'].items()}
+            register(Dataset(file=entry, **settings), profile=False)
+        else:
+            register(Dataset(entry, entry, normalize=False, encode_labels=True,
+                             description='Prepared by ingest.py'), profile=False)
+
+#look a dataset up by its file name (or a path ending in it)
+def get(data_path):
+    file = os.path.basename(os.path.normpath(data_path))
+    if file not in REGISTRY:
+        discover()
+    if file not in REGISTRY:
+        raise ValueError('Unknown dataset: ' + file + ' (known: ' + ', '.join(sorted(REGISTRY)) + ')')
+    return REGISTRY[file]
+
+# ## Profiles
+def _finite(value):
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+def compute_profile(dataset):
+    df = dataset_cache.load(dataset.path)
+    y = df[dataset.label]
+    counts = y.value_counts(dropna=False).sort_index()
+    if dataset.classes is not None and not dataset.encode_labels:
+        class_counts = {dataset.classes[int(k)]: int(v) for k, v in counts.items()}
+    else:
+        class_counts = {str(k): int(v) for k, v in counts.items()}
+
+    column_stats = {}
+    for c in df.columns:
+        if c == dataset.label or df[c].dtype == object:
+            continue
+        values = np.asarray(df[c], dtype=np.float64)
+        finite = np.isfinite(values)
+        any_finite = finite.any()
+        column_stats[c] = {'min': _finite(values[finite].min()) if any_finite else None,
+                           'max': _finite(values[finite].max()) if any_finite else None,
+                           'mean': _finite(values[finite].mean()) if any_finite else None,
+                           'missing': int(np.isnan(values).sum()),
+                           'infinite': int(np.isinf(values).sum())}
+
+    return {'rows': len(df), 'columns': len(df.columns), 'class_counts': class_counts,
+            'column_stats': column_stats, 'created': str(datetime.datetime.now())}
+
+def _profile_file(dataset):
+    return os.path.join(PROFILE_DIR, dataset.file + '.json')
+
+#compute=False only returns a profile that is already stored for the current version of the file
+def get_profile(dataset, compute=True):
+    if not dataset.available():
+        return None
+    fp = dataset.fingerprint(compute)
+    if fp is None:
+        return None
+    cached = _profiles.get(dataset.file)
+    if cached is not None and cached['fingerprint'] == fp:
+        return cached
+
+    with _profile_lock:
+        try:
+            with open(_profile_file(dataset)) as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            profile = None
+        if profile is None or profile.get('fingerprint') != fp:
+            if not compute:
+                return None
+            profile = dict(compute_profile(dataset), fingerprint=fp)
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(_profile_file(dataset), 'w') as f:
+                json.dump(profile, f, indent=2)
+        _profiles[dataset.file] = profile
+    return profile
+
+#profile every available dataset that doesn't have one yet (run when the server starts)
+def profile_all():
+    discover()
+    for dataset in REGISTRY.values():
+        get_profile(dataset)
+
+#registered datasets with their profiles, for the front end
+def list_json():
+    discover()
+    rows = []
+    for dataset in REGISTRY.values():
+        row = dataset.as_dict()
+        row['profile'] = get_profile(dataset, compute=False) if row['available'] else None
+        rows.append(row)
+    return json.dumps({'datasets': rows})
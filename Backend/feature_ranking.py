@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+from joblib import Parallel, delayed
+
+# Mutual information between every feature and the label, for mth.py's information gain ranking.
+# Two estimators:
+# - 'binned' (default): every feature is cut into up to BINS equal-frequency bins (edges taken from at
+#   most EDGE_SAMPLE rows) and the MI of the binned feature and the label is read off their joint
+#   histogram, with the Miller-Madow bias correction. One bincount per feature, and the features are
+#   processed in parallel threads (the numpy work releases the GIL)
+# - 'knn': sklearn's mutual_info_classif, the k-nearest-neighbour estimator the paper used; exact but
+#   it searches the neighbours of every row for every feature
+# Both return nats, so the ranking and the 90% cumulative importance cut in mth.py work the same way.
+# IDS_MI_ESTIMATOR sets the default estimator.
+ESTIMATOR = os.environ.get('IDS_MI_ESTIMATOR', 'binned')
+ESTIMATORS = ('binned', 'knn')
+BINS = 32
+EDGE_SAMPLE = 100000
+
+#bin index of every value of x: equal-frequency bins, so skewed flow statistics still spread over the bins;
+#a column with fewer distinct values than bins keeps one bin per value
+def bin_codes(x, bins=BINS, edge_rows=None):
+    sample = x if edge_rows is None else x[edge_rows]
+    edges = np.unique(np.nanquantile(sample, np.linspace(0, 1, bins + 1)[1:-1]))
+    return np.searchsorted(edges, x, side='left')
+
+#entropy in nats of a histogram, plus the number of non-empty cells for the bias correction
+def entropy_counts(counts, n):
+    counts = counts[counts > 0]
+    p = counts / n
+    return -np.sum(p * np.log(p)), len(counts)
+
+def binned_mi_column(x, y_codes, n_classes, h_y, m_y, bins=BINS, edge_rows=None):
+    n = len(x)
+    codes = bin_codes(x, bins, edge_rows)
+    n_bins = int(codes.max()) + 1 if n else 1
+    h_x, m_x = entropy_counts(np.bincount(codes, minlength=n_bins), n)
+    h_xy, m_xy = entropy_counts(np.bincount(codes * n_classes + y_codes, minlength=n_bins * n_classes), n)
+    # Miller-Madow: each entropy is biased low by (non-empty cells - 1) / 2n
+    mi = h_x + h_y - h_xy + ((m_x - 1) + (m_y - 1) - (m_xy - 1)) / (2.0 * n)
+    return max(mi, 0.0)
+
+def binned_mi(X, y, bins=BINS, n_jobs=-1, random_state=0):
+    X = np.asarray(X)
+    _, y_codes = np.unique(np.asarray(y), return_inverse=True)
+    y_codes = y_codes.ravel()
+    n_classes = int(y_codes.max()) + 1 if len(y_codes) else 1
+    h_y, m_y = entropy_counts(np.bincount(y_codes, minlength=n_classes), len(y_codes))
+
+    edge_rows = None
+    if len(X) > EDGE_SAMPLE:
+        edge_rows = np.sort(np.random.default_rng(random_state).choice(len(X), EDGE_SAMPLE, replace=False))
+
+    mi = Parallel(n_jobs=n_jobs, prefer='threads')(
+        delayed(binned_mi_column)(X[:, i], y_codes, n_classes, h_y, m_y, bins, edge_rows) for i in range(X.shape[1]))
+    return np.asarray(mi, dtype=float)
+
+def knn_mi(X, y, random_state=None):
+    from sklearn.feature_selection import mutual_info_classif
+    return mutual_info_classif(np.asarray(X), np.asarray(y), random_state=random_state)
+
+#MI of every column of X with y, with the given estimator ('binned' or 'knn', ESTIMATOR when None)
+def mutual_info(X, y, estimator=None, bins=BINS, n_jobs=-1):
+    estimator = estimator or ESTIMATOR
+    if estimator == 'binned':
+        return binned_mi(X, y, bins, n_jobs)
+    if estimator == 'knn':
+        return knn_mi(X, y)
+    raise ValueError('Unknown mi_estimator: ' + str(estimator) + ' (' + ' or '.join(ESTIMATORS) + ')')
+
+#stage_cache parameters of an estimator, so the stored importances of one estimator are never read for another
+def params(estimator=None, bins=BINS):
+    estimator = estimator or ESTIMATOR
+    if estimator == 'binned':
+        return {'estimator': estimator, 'bins': bins, 'edge_sample': EDGE_SAMPLE}
+    return {'estimator': estimator}
@@ -0,0 +1,63 @@
+import ast
+import io
+import os
+import sqlite3
+from functools import lru_cache
+
+# Confusion matrix heatmaps are not drawn while a model runs: pyplot figures created on the request
+# path were never closed and piled up in the server process. The matrix is already stored with each
+# run (heatmap_data), so the image is rendered from it when the front end asks for it.
+# Set IDS_SHOW_PLOTS=1 to get the old pyplot figures back when running a model script interactively.
+HEADLESS = os.environ.get('IDS_SHOW_PLOTS', '0') != '1'
+
+MODEL_TABLES = {'lccde': 'LCCDE', 'mth': 'mth', 'treebased': 'TreeBased'}
+
+#pyplot heatmap of a confusion matrix, only when not headless
+def plot_confusion_matrix(cm):
+    if HEADLESS:
+        return
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    f,ax=plt.subplots(figsize=(5,5))
+    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
+    plt.xlabel("y_pred")
+    plt.ylabel("y_true")
+
+#render a heatmap_data string (str(cm.tolist())) to png bytes
+#uses a standalone Figure instead of pyplot, so nothing is registered globally and it is safe across request threads
+@lru_cache(maxsize=64)
+def render_png(heatmap_data):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import seaborn as sns
+
+    cm = ast.literal_eval(heatmap_data)
+    fig = Figure(figsize=(5,5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
+    ax.set_xlabel("y_pred")
+    ax.set_ylabel("y_true")
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight')
+    return buf.getvalue()
+
+#png heatmap for a stored run, None if the run doesn't exist
+def get_heatmap(model, run_id):
+    table = MODEL_TABLES.get(model.lower())
+    if table is None:
+        raise ValueError('Unknown model: ' + str(model))
+
+    connection = sqlite3.connect('test_DB.db')
+    c = connection.cursor()
+
+    c.execute("SELECT heatmap_data FROM " + table + " WHERE run_id = ?", (run_id,))
+    row = c.fetchone()
+
+    c.close()
+    connection.close()
+
+    if row is None or row[0] is None:
+        return None
+    return render_png(row[0])
@@ -0,0 +1,266 @@
+import contextlib
+import datetime
+import math
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from joblib import effective_n_jobs
+from joblib.externals.loky import ProcessPoolExecutor
+from hyperopt import rand, space_eval, tpe, STATUS_OK, Trials
+from hyperopt.base import Domain, JOB_STATE_DONE
+
+import trial_store
+
+# BO-TPE searches for mth.py with trials evaluated side by side.
+# hyperopt's fmin evaluates one trial at a time. With parallelism > 1 the search instead asks TPE for a
+# batch of `parallelism` suggestions (each suggestion is drawn with its own seed from the finished trials,
+# the in-flight ones are not known to it yet), evaluates the batch in a pool of worker processes and
+# adds the results before asking for the next batch. Every search has a pool of its own (not joblib's
+# shared executor), so searches that run side by side, like mth.py's branches, don't share or resize
+# each other's workers and each one uses exactly the workers task_graph counts for it. The first 20 trials are TPE's random start-up
+# trials either way, so with the default hpo_max_evals=20 a batched search draws from the same
+# distribution as the sequential one.
+# The training arrays are written once per search as .npy files and memory-mapped read-only by the
+# workers (SharedData), so a trial only sends its parameters to the pool.
+# parallelism: 1 evaluates one trial at a time like hyperopt.fmin, -1 uses every core;
+# IDS_HPO_PARALLELISM sets the default for requests that don't give hpo_parallelism.
+#
+# mode='halving' is successive halving instead of TPE: max_evals random candidates are scored after
+# training on a stratified subsample of the training rows, the best 1/ETA of them go on to a subsample
+# ETA times larger, and so on up to the full training set, where the winner is picked. A candidate
+# that is clearly worse (a 10-tree forest, an XGBoost with a learning rate of 2) is dropped after a fit
+# on a fraction of the data. With hpo_max_evals=20 the rungs are 20 candidates on 1/9 of the rows,
+# 7 on 1/3 and 3 on all of them, about 8 full fits instead of 20. The test set is always scored whole.
+# IDS_HPO_MODE sets the default mode (tpe).
+#
+# An objective may return more than loss and status, e.g. the fitted estimator and its test predictions.
+# Those extras are kept for the best trial evaluated in this process only (BestTrial) and handed to the
+# caller through `kept` when that trial wins the search, so the winner doesn't have to be fitted again.
+# Trials run in worker processes, on a subsample or answered by trial_store.py have no extras; the
+# caller refits then.
+PARALLELISM = int(os.environ.get('IDS_HPO_PARALLELISM', '1'))
+MODE = os.environ.get('IDS_HPO_MODE', 'tpe')
+MODES = ('tpe', 'halving')
+ETA = 3
+MIN_CLASS_ROWS = 10
+RESULT_KEYS = ('loss', 'status')
+
+_mapped = {}
+
+#the arrays an objective is evaluated on; with parallelism > 1 they are saved under a temporary
+#directory and only the file names are pickled to the workers
+class SharedData:
+
+    def __init__(self, arrays, parallelism=1):
+        self.paths = None
+        self.directory = None
+        self._arrays = tuple(arrays)
+        if workers(parallelism) > 1:
+            self.directory = tempfile.mkdtemp(prefix='ids_hpo_')
+            self.paths = []
+            for i, a in enumerate(self._arrays):
+                path = os.path.join(self.directory, str(i) + '.npy')
+                np.save(path, np.asarray(a))
+                self.paths.append(path)
+
+    def arrays(self):
+        if self._arrays is not None:
+            return self._arrays
+        # read-only memory maps, opened once per worker process
+        for path in self.paths:
+            if path not in _mapped:
+                _mapped[path] = np.load(path, mmap_mode='r')
+        return tuple(_mapped[path] for path in self.paths)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.paths is not None:
+            state['_arrays'] = None
+        return state
+
+    def close(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            for path in self.paths:
+                _mapped.pop(path, None)
+            self.directory = None
+
+def workers(parallelism):
+    return effective_n_jobs(int(parallelism)) if parallelism else 1
+
+#sorted positions of a random fraction of every class (at least MIN_CLASS_ROWS of each, or all of them)
+def stratified_rows(y, fraction, seed):
+    rng = np.random.default_rng(seed)
+    y = np.asarray(y)
+    rows = []
+    for label in np.unique(y):
+        idx = np.flatnonzero(y == label)
+        keep = min(len(idx), max(MIN_CLASS_ROWS, int(round(fraction * len(idx)))))
+        rows.append(rng.choice(idx, keep, replace=False))
+    return np.sort(np.concatenate(rows))
+
+#the loss and status of a result, without the extras
+def summary(result):
+    return {k: v for k, v in result.items() if k in RESULT_KEYS}
+
+#the extras of the best trial a search evaluated in this process so far (one trial's worth at a time)
+class BestTrial:
+
+    def __init__(self):
+        self.loss = np.inf
+        self.key = None
+        self.extras = None
+
+    def offer(self, key, result):
+        extras = {k: v for k, v in result.items() if k not in RESULT_KEYS}
+        if extras and result.get('status') == STATUS_OK and result['loss'] < self.loss:
+            self.loss, self.key, self.extras = result['loss'], key, extras
+
+#the objective on the arrays, (X_train, X_test, y_train, y_test); subsample=(fraction, seed) trains on a
+#stratified subsample, drawn where the trial runs so only the two numbers are sent to a worker. In a
+#worker the extras are dropped (strip) instead of being pickled back
+def evaluate(fn, params, data, subsample=None, strip=False):
+    arrays = list(data.arrays())
+    if subsample is not None:
+        rows = stratified_rows(arrays[2], *subsample)
+        arrays[0] = arrays[0][rows]
+        arrays[2] = arrays[2][rows]
+    result = fn(params, *arrays)
+    return summary(result) if strip else result
+
+#minimize fn(params, X_train, X_test, y_train, y_test) over space, with BO-TPE or successive halving;
+#returns the best point like hyperopt.fmin (hp.choice parameters as indices). data is a SharedData or
+#the sequence of arrays. With a family name (e.g. 'RF') the search reads and adds to trial_store.py.
+#kept (a dict) receives the extras of the winning trial when they are available
+def fmin(fn, space, max_evals, data, parallelism=None, mode=None, family=None, kept=None):
+    parallelism = PARALLELISM if parallelism is None else parallelism
+    mode = mode or MODE
+    if mode not in MODES:
+        raise ValueError('Unknown hpo_mode: ' + str(mode) + ' (tpe or halving)')
+    owned = not isinstance(data, SharedData)
+    if owned:
+        data = SharedData(data, parallelism)
+    try:
+        context = None
+        if family is not None and trial_store.ENABLED:
+            context = trial_store.context_key(family, space, data.arrays())
+        n_workers = 1 if data.paths is None else workers(parallelism)
+        best_trial = BestTrial() if kept is not None else None
+        if mode == 'halving':
+            point = halving_fmin(fn, space, max_evals, data, n_workers, context=context, best=best_trial)
+        else:
+            point = tpe_fmin(fn, space, max_evals, data, n_workers, context, best_trial)
+        if best_trial is not None and best_trial.key == trial_store.params_key(space_eval(space, point)):
+            kept.update(best_trial.extras)
+        return point
+    finally:
+        if owned:
+            data.close()
+
+#max_evals TPE suggestions, n_workers at a time; one at a time is what hyperopt.fmin does. The search
+#starts from the stored trials of the context, and max_evals counts the new suggestions only
+def tpe_fmin(fn, space, max_evals, data, n_workers, context=None, best=None):
+    trials = Trials()
+    domain = Domain(lambda params: None, space)
+    if context is not None:
+        add_history(trials, domain, trial_store.history(context))
+    target = len(trials.trials) + max_evals
+    rng = np.random.default_rng()
+    with pool(n_workers) as parallel:
+        while len(trials.trials) < target:
+            batch = min(n_workers, target - len(trials.trials))
+            docs = []
+            for tid in trials.new_trial_ids(batch):
+                docs.extend(tpe.suggest([tid], domain, trials, int(rng.integers(2**31 - 1))))
+            points = [{k: v[0] for k, v in doc['misc']['vals'].items() if v} for doc in docs]
+
+            results = evaluate_points(parallel, fn, space, points, data, context, best=best)
+
+            now = datetime.datetime.now()
+            for doc, result in zip(docs, results):
+                doc['state'] = JOB_STATE_DONE
+                doc['result'] = result
+                doc['book_time'] = doc['refresh_time'] = now
+            trials.insert_trial_docs(docs)
+            trials.refresh()
+    return trials.argmin
+
+#stored (point, loss) pairs as finished trials, so TPE models them like its own
+def add_history(trials, domain, rows):
+    if not rows:
+        return
+    docs = []
+    now = datetime.datetime.now()
+    for tid, (point, loss) in zip(trials.new_trial_ids(len(rows)), rows):
+        misc = {'tid': tid, 'cmd': domain.cmd, 'workdir': domain.workdir,
+                'idxs': {k: [tid] if k in point else [] for k in domain.params},
+                'vals': {k: [point[k]] if k in point else [] for k in domain.params}}
+        doc = trials.new_trial_docs([tid], [None], [{'loss': loss, 'status': STATUS_OK}], [misc])[0]
+        doc['state'] = JOB_STATE_DONE
+        doc['book_time'] = doc['refresh_time'] = now
+        docs.append(doc)
+    trials.insert_trial_docs(docs)
+    trials.refresh()
+
+#a process pool of the search's own for n_workers > 1 (loky, so the objectives may be closures), None to
+#evaluate in this process; the workers are stopped when the search ends
+@contextlib.contextmanager
+def pool(n_workers):
+    if n_workers <= 1:
+        yield None
+        return
+    executor = ProcessPoolExecutor(max_workers=n_workers)
+    try:
+        yield executor
+    finally:
+        executor.shutdown(wait=True)
+
+def evaluate_all(parallel, fn, points, data, subsample=None):
+    if parallel is None:
+        return [evaluate(fn, params, data, subsample) for params in points]
+    futures = [parallel.submit(evaluate, fn, params, data, subsample, True) for params in points]
+    return [f.result() for f in futures]
+
+#results of the points (index form); each distinct parameter set is fitted once, and with a context the
+#ones already in the store are not fitted at all (full fidelity only, a subsample result isn't stored).
+#The results are summaries; full-fidelity extras are offered to best
+def evaluate_points(parallel, fn, space, points, data, context=None, subsample=None, best=None):
+    params = [space_eval(space, p) for p in points]
+    keys = [trial_store.params_key(p) for p in params]
+    stored = context is not None and subsample is None
+    known = trial_store.lookup(context, keys) if stored else {}
+
+    todo = []
+    for i, key in enumerate(keys):
+        if key not in known and all(keys[j] != key for j in todo):
+            todo.append(i)
+    for i, result in zip(todo, evaluate_all(parallel, fn, [params[i] for i in todo], data, subsample)):
+        if best is not None and subsample is None:
+            best.offer(keys[i], result)
+        known[keys[i]] = summary(result)
+    if stored:
+        trial_store.save(context, [(points[i], params[i], known[keys[i]]) for i in todo])
+    return [known[key] for key in keys]
+
+#point (hyperopt's index form) of n random draws from space
+def random_points(space, n, seed):
+    trials = Trials()
+    docs = rand.suggest(trials.new_trial_ids(n), Domain(lambda params: None, space), trials, seed)
+    return [{k: v[0] for k, v in doc['misc']['vals'].items() if v} for doc in docs]
+
+def halving_fmin(fn, space, max_evals, data, n_workers, eta=ETA, context=None, best=None):
+    rng = np.random.default_rng()
+    points = random_points(space, max_evals, int(rng.integers(2**31 - 1)))
+    n_rungs = int(math.log(max_evals) / math.log(eta) + 1e-9) + 1 if max_evals > 1 else 1
+    with pool(n_workers) as parallel:
+        for rung in range(n_rungs):
+            last = rung == n_rungs - 1
+            # the same subsample for every candidate of a rung, so their scores are comparable
+            subsample = None if last else (float(eta) ** (rung + 1 - n_rungs), int(rng.integers(2**31 - 1)))
+            results = evaluate_points(parallel, fn, space, points, data, context, subsample, best)
+            order = np.argsort([r['loss'] for r in results], kind='stable')
+            if last:
+                return points[order[0]]
+            points = [points[i] for i in order[:math.ceil(len(points) / eta)]]
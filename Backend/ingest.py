@@ -0,0 +1,177 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import dataset_cache
+import preprocess
+from datasets import CICIDS2017_CLASSES
+from artifact_store import dataset_fingerprint
+
+# Chunked ingestion of the full CICIDS2017 corpus (the per-day CSVs, 2.8M flows).
+# Pass 1 streams every file in chunks of CHUNK_ROWS rows and collects the row count, the class counts
+# and the column minima/maxima. Pass 2 streams the files again, min-max normalizes each chunk with
+# those statistics, maps the raw labels onto the seven classes of the sampled datasets and appends
+# the rows to per-column .npy files. Only one chunk is in memory at a time, so the peak memory
+# doesn't depend on the size of the corpus.
+# The output directory has the dataset_cache layout, so dataset_cache.load(out_dir) memory-maps it.
+CHUNK_ROWS = 200000
+
+# raw CICIDS2017 labels -> classes of CICIDS2017_sample.csv, keyed by the label with everything but
+# letters and digits removed and lowercased (the web attack labels contain a dash that is mis-encoded
+# differently depending on the file)
+CICIDS2017_LABEL_MAP = {
+    'benign': 'BENIGN',
+    'bot': 'Bot',
+    'ftppatator': 'BruteForce',
+    'sshpatator': 'BruteForce',
+    'ddos': 'DoS',
+    'doshulk': 'DoS',
+    'dosgoldeneye': 'DoS',
+    'dosslowloris': 'DoS',
+    'dosslowhttptest': 'DoS',
+    'heartbleed': 'DoS',
+    'infiltration': 'Infiltration',
+    'portscan': 'PortScan',
+    'webattackbruteforce': 'WebAttack',
+    'webattackxss': 'WebAttack',
+    'webattacksqlinjection': 'WebAttack',
+}
+# files that already use the sampled class names
+CICIDS2017_LABEL_MAP.update({c.lower(): c for c in CICIDS2017_CLASSES})
+
+def label_key(raw):
+    return re.sub(r'[^0-9a-z]', '', str(raw).lower())
+
+#map a chunk of raw labels (few distinct values) to class names; unknown labels raise
+def map_labels(raw, label_map):
+    mapping = {}
+    for value in pd.unique(raw):
+        key = label_key(value)
+        if key not in label_map:
+            raise ValueError('Unknown label ' + repr(value))
+        mapping[value] = label_map[key]
+    return raw.map(mapping)
+
+def csv_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.csv'))))
+        else:
+            files.append(path)
+    if not files:
+        raise ValueError('No csv files in ' + ', '.join(paths))
+    return files
+
+#the raw files have leading spaces in the column names and a few non-utf8 bytes in the labels
+def read_chunks(path, chunksize):
+    for chunk in pd.read_csv(path, chunksize=chunksize, encoding='latin-1', low_memory=False):
+        chunk.columns = [c.strip() for c in chunk.columns]
+        yield chunk
+
+def feature_matrix(chunk, features):
+    X = chunk[features].apply(pd.to_numeric, errors='coerce')
+    return X.to_numpy(dtype=np.float64)
+
+# ## Pass 1: statistics
+def scan(files, label='Label', label_map=CICIDS2017_LABEL_MAP, chunksize=CHUNK_ROWS):
+    features = None
+    dropped = []
+    col_min = col_max = None
+    class_counts = {}
+    rows = 0
+
+    for path in files:
+        for chunk in read_chunks(path, chunksize):
+            if features is None:
+                # identifier columns (Flow ID, IPs, Timestamp) are not features
+                features = [c for c in chunk.columns if c != label and chunk[c].dtype != object]
+                dropped = [c for c in chunk.columns if c != label and chunk[c].dtype == object]
+            elif [c for c in chunk.columns if c != label and c not in dropped] != features:
+                raise ValueError(path + ' has different columns than ' + files[0])
+
+            chunk = chunk[chunk[label].notna()]
+            counts = map_labels(chunk[label], label_map).value_counts()
+            for name, count in counts.items():
+                class_counts[name] = class_counts.get(name, 0) + int(count)
+
+            lo, hi = preprocess.minmax_fit(feature_matrix(chunk, features))
+            col_min = lo if col_min is None else np.fmin(col_min, lo)
+            col_max = hi if col_max is None else np.fmax(col_max, hi)
+            rows += len(chunk)
+
+    return {'features': features, 'dropped': dropped, 'rows': rows, 'class_counts': class_counts,
+            'min': col_min, 'max': col_max}
+
+# ## Pass 2: normalized, label-encoded output
+def write(files, out_dir, stats, classes, label='Label', label_map=CICIDS2017_LABEL_MAP,
+          chunksize=CHUNK_ROWS, dtype=np.float32):
+    features = stats['features']
+    columns = [{'name': name, 'file': 'c' + str(i) + '.npy', 'dtype': np.dtype(dtype).name}
+               for i, name in enumerate(features)]
+    columns.append({'name': label, 'file': 'c' + str(len(features)) + '.npy', 'dtype': 'object', 'categories': classes})
+
+    # each column file gets its .npy header up front (the row count is known from pass 1) and the
+    # chunks are appended to it, so nothing but the current chunk is held in memory
+    dtypes = [np.dtype(dtype)] * len(features) + [np.dtype(np.int32)]
+    outputs = []
+    for c, dt in zip(columns, dtypes):
+        f = open(os.path.join(out_dir, c['file']), 'wb')
+        np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(dt), 'fortran_order': False, 'shape': (stats['rows'],)})
+        outputs.append(f)
+    class_index = {c: i for i, c in enumerate(classes)}
+
+    try:
+        for path in files:
+            for chunk in read_chunks(path, chunksize):
+                chunk = chunk[chunk[label].notna()]
+                X = preprocess.minmax_apply(feature_matrix(chunk, features), stats['min'], stats['max'])
+                for i in range(len(features)):
+                    outputs[i].write(X[:, i].astype(dtypes[i]).tobytes())
+                codes = map_labels(chunk[label], label_map).map(class_index).to_numpy()
+                outputs[-1].write(codes.astype(dtypes[-1]).tobytes())
+    finally:
+        for f in outputs:
+            f.close()
+    return columns
+
+def ingest(paths, out_dir, label='Label', label_map=CICIDS2017_LABEL_MAP, classes=CICIDS2017_CLASSES,
+           chunksize=CHUNK_ROWS, dtype=np.float32):
+    files = csv_files(paths)
+    stats = scan(files, label, label_map, chunksize)
+
+    # written next to out_dir and renamed at the end, so a half-written dataset is never picked up
+    tmp = out_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = write(files, tmp, stats, classes, label, label_map, chunksize, dtype)
+
+    meta = {'sources': [{'path': os.path.abspath(f), 'fingerprint': dataset_fingerprint(f)} for f in files],
+            'rows': stats['rows'], 'columns': columns, 'normalized': True,
+            'classes': classes, 'class_counts': stats['class_counts'], 'dropped_columns': stats['dropped'],
+            'min': stats['min'].tolist(), 'max': stats['max'].tolist(), 'created': str(datetime.datetime.now())}
+    with open(os.path.join(tmp, dataset_cache.META_FILE), 'w') as f:
+        # the minima/maxima can be inf/NaN (e.g. Flow Bytes/s), json writes those as Infinity/NaN
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.rename(tmp, out_dir)
+    return meta
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Normalize and label-encode the CICIDS2017 csv files in bounded memory')
+    parser.add_argument('paths', nargs='+', help='csv files or directories of csv files')
+    parser.add_argument('--out', default='./Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/CICIDS2017_full')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    meta = ingest(args.paths, args.out, chunksize=args.chunksize)
+    print(str(meta['rows']) + ' rows written to ' + args.out)
+    print(meta['class_counts'])
@@ -18,7 +18,7 @@
 # navigate to Backend folder
 # run: python interface.py
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 app = Flask(__name__)
 CORS(app)
@@ -26,6 +26,8 @@ CORS(app)
 import mth_helper
 import treebased_helper
 import lccde_helper
+import heatmap
+import datasets
 import json
 
 @app.route('/run-python-code', methods=['POST'])
@@ -42,7 +44,10 @@ def alg1():
     params = request.json.get('code')
     #jsonify incoming
     params = json.loads(params)
-    result_json = lccde_helper.run(params)
+    try:
+        result_json = lccde_helper.run(params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     return jsonify(result_json)
 
@@ -51,11 +56,27 @@ def alg2():
     result_json = lccde_helper.get_runs()
     return jsonify(result_json)
 
+# score new flow records with the ensemble of an earlier LCCDE run
+# body: {"run_id": <id>, "rows": [{<feature>: <value>, ...}, ...], "normalized": false}
+@app.route('/scoreLccde', methods=['POST'])
+def alg7():
+    params = request.json.get('code')
+    params = json.loads(params)
+    try:
+        result_json = lccde_helper.score(params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(result_json)
+
 @app.route('/runMth', methods=['PUT'])
 def alg3():
     params = request.json.get('code')
     params = json.loads(params)
-    result_json = mth_helper.run(params)
+    try:
+        result_json = mth_helper.run(params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     return jsonify(result_json)
 
@@ -68,7 +89,10 @@ def alg4():
 def alg5():
     params = request.json.get('code')
     params = json.loads(params)
-    result_json = treebased_helper.run(params)
+    try:
+        result_json = treebased_helper.run(params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     print(result_json)
     return jsonify(result_json)
     # pass
@@ -80,6 +104,28 @@ def alg6():
     return jsonify(result_json)
     # pass
 
+# confusion matrix heatmap of a stored run as a png, rendered when asked for instead of during the run
+# model is one of lccde, mth, treebased
+@app.route('/heatmap/<model>/<int:run_id>', methods=['GET'])
+def heatmap_png(model, run_id):
+    try:
+        png = heatmap.get_heatmap(model, run_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if png is None:
+        return jsonify({'error': 'No run with id ' + str(run_id)}), 404
+
+    return Response(png, mimetype='image/png')
+
+# datasets the models can be run on, with their preparation settings and cached profiles
+@app.route('/datasets', methods=['GET'])
+def list_datasets():
+    result_json = datasets.list_json()
+    return jsonify(result_json)
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    # profile the datasets up front so /datasets never has to read one
+    datasets.profile_all()
+    # threaded so overlapping runs are served side by side
+    app.run(debug=True, threaded=True)
 
@@ -0,0 +1,156 @@
+import argparse
+import datetime
+import json
+import os
+import shutil
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+import dataset_cache
+import datasets
+import preprocess
+
+# K-means typical sampling, the reduction that produced CICIDS2017_sample_km.csv (the commented-out
+# block at the top of mth.py), as a step that can be run on any registered dataset, including the
+# full corpus prepared by ingest.py:
+# - the minority classes are kept completely
+# - the remaining rows are clustered with MiniBatchKMeans and FRACTION of every cluster is kept, so
+#   the sample still covers every region of the majority traffic
+# The majority rows are read CHUNK_ROWS at a time from the (memory-mapped) dataset: when they don't fit
+# in one chunk the clusters are fitted with partial_fit over the chunks and the rows are assigned chunk
+# by chunk. The k-means steps run on all cores through sklearn's OpenMP kernels.
+# The output is a prepared directory in the data folder with its registry settings in meta.json, so
+# datasets.py picks it up as a new dataset.
+N_CLUSTERS = 1000
+FRACTION = 0.008
+MINORITY_CLASSES = ['Bot', 'Infiltration', 'WebAttack']
+CHUNK_ROWS = 200000
+BATCH_ROWS = 4096
+
+#feature matrix of the given rows, read column by column so a memory-mapped frame is only touched there
+def feature_block(columns, rows):
+    return np.column_stack([col[rows] for col in columns])
+
+def fit_clusters(columns, rows, n_clusters=N_CLUSTERS, chunksize=CHUNK_ROWS, batch_size=BATCH_ROWS, random_state=0):
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, random_state=random_state)
+    if len(rows) <= chunksize:
+        return kmeans.fit(feature_block(columns, rows))
+
+    # one pass over the rows in random order; the first batch is large enough to initialize every cluster
+    rng = np.random.default_rng(random_state)
+    order = rng.permutation(rows)
+    init_rows = max(3 * n_clusters, batch_size)
+    chunksize = max(chunksize, init_rows)
+    for start in range(0, len(order), chunksize):
+        chunk = np.sort(order[start:start + chunksize])
+        X = feature_block(columns, chunk)[rng.permutation(len(chunk))]
+        if start == 0:
+            kmeans.partial_fit(X[:init_rows])
+            X = X[init_rows:]
+        for b in range(0, len(X), batch_size):
+            kmeans.partial_fit(X[b:b + batch_size])
+    return kmeans
+
+def assign_clusters(kmeans, columns, rows, chunksize=CHUNK_ROWS):
+    klabel = np.empty(len(rows), dtype=np.int64)
+    for start in range(0, len(rows), chunksize):
+        klabel[start:start + chunksize] = kmeans.predict(feature_block(columns, rows[start:start + chunksize]))
+    return klabel
+
+#positions (into klabel) of a random fraction of every cluster, round(fraction * cluster size) each like
+#groupby('klabel').apply(lambda g: g.sample(frac=fraction)): the rows are shuffled, stably sorted by
+#cluster (a radix sort on the small cluster ids) and the first ones of each cluster are kept
+def typical_sample(klabel, fraction=FRACTION, random_state=0):
+    rng = np.random.default_rng(random_state)
+    counts = np.bincount(klabel)
+    keep = np.round(counts * fraction).astype(np.int64)
+
+    shuffled = rng.permutation(len(klabel))
+    order = shuffled[np.argsort(klabel[shuffled].astype(preprocess.label_dtype(klabel)), kind='stable')]
+    cluster = klabel[order]
+    starts = np.cumsum(counts) - counts
+    rank = np.arange(len(klabel)) - starts[cluster]
+    return np.sort(order[rank < keep[cluster]])
+
+#class names of every row, whether the dataset stores names or integer codes
+def class_names(df, ds):
+    y = df[ds.label].to_numpy()
+    if ds.encode_labels:
+        return y.astype(str)
+    return np.asarray(ds.classes, dtype=object)[y.astype(int)].astype(str)
+
+def reduce(data_path, name, n_clusters=N_CLUSTERS, fraction=FRACTION, minority=MINORITY_CLASSES,
+           chunksize=CHUNK_ROWS, smote=None, random_state=0):
+    ds = datasets.get(data_path)
+    df = dataset_cache.load(ds.path)
+    features = [c for c in df.columns if c != ds.label and df[c].dtype != object]
+
+    col_min = col_max = None
+    if ds.normalize:
+        # raw csv datasets are small enough to be normalized in memory
+        df, col_min, col_max = preprocess.normalize(df, features)
+    elif ds.scaling() is not None:
+        col_min, col_max = ds.scaling()
+
+    names = class_names(df, ds)
+    is_minor = np.isin(names, minority)
+    major = np.flatnonzero(~is_minor)
+    columns = [df[c].to_numpy() for c in features]
+
+    kmeans = fit_clusters(columns, major, n_clusters, chunksize, random_state=random_state)
+    klabel = assign_clusters(kmeans, columns, major, chunksize)
+    sampled = major[typical_sample(klabel, fraction, random_state)]
+    rows = np.sort(np.concatenate([np.flatnonzero(is_minor), sampled]))
+
+    out = df.iloc[rows][features].reset_index(drop=True)
+    out[ds.label] = names[rows].astype(object)
+
+    settings = {'name': name, 'label': ds.label, 'normalize': False, 'encode_labels': True, 'smote': smote,
+                'description': 'K-means typical sample of ' + ds.file + ' (' + str(n_clusters) + ' clusters, ' +
+                               str(fraction) + ' of each, minority classes kept)'}
+    out_dir = os.path.join(datasets.DATA_DIR, name)
+    # written next to out_dir and renamed at the end, so a half-written dataset is never picked up
+    tmp = out_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    meta = {'source': os.path.abspath(ds.path), 'source_fingerprint': ds.fingerprint(), 'rows': len(out),
+            'columns': dataset_cache.write_columns(out, tmp), 'normalized': True,
+            'class_counts': {str(k): int(v) for k, v in out[ds.label].value_counts().sort_index().items()},
+            'sampling': {'n_clusters': n_clusters, 'fraction': fraction, 'minority': list(minority),
+                         'random_state': random_state, 'inertia': float(kmeans.inertia_)},
+            'dataset': settings, 'created': str(datetime.datetime.now())}
+    if col_min is not None:
+        meta['min'] = np.asarray(col_min, dtype=float).tolist()
+        meta['max'] = np.asarray(col_max, dtype=float).tolist()
+    with open(os.path.join(tmp, dataset_cache.META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.rename(tmp, out_dir)
+
+    datasets.register(datasets.Dataset(file=name, **settings))
+    return meta
+
+#'2:1000,4:1000' -> {2: 1000, 4: 1000}
+def parse_smote(text):
+    if not text:
+        return None
+    return {int(k): int(v) for k, v in (pair.split(':') for pair in text.split(','))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reduce a dataset by k-means typical sampling and register the result')
+    parser.add_argument('dataset', help='registered dataset (file name or path), e.g. CICIDS2017_full')
+    parser.add_argument('--name', default='CICIDS2017_km', help='name of the output directory in the data folder')
+    parser.add_argument('--clusters', type=int, default=N_CLUSTERS)
+    parser.add_argument('--fraction', type=float, default=FRACTION)
+    parser.add_argument('--minority', nargs='*', default=MINORITY_CLASSES, help='classes kept completely')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--smote', default='', help='SMOTE targets for the new dataset, e.g. 2:1000,4:1000')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    meta = reduce(args.dataset, args.name, args.clusters, args.fraction, args.minority,
+                  args.chunksize, parse_smote(args.smote), args.seed)
+    print(str(meta['rows']) + ' rows written to ' + os.path.join(datasets.DATA_DIR, args.name))
+    print(meta['class_counts'])
@@ -13,187 +13,110 @@
 # %%
 import warnings
 
-from sklearn.calibration import LabelEncoder
 warnings.filterwarnings("ignore")
 
 # %%
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report,confusion_matrix,accuracy_score, precision_score, recall_score, f1_score
 import lightgbm as lgb
 import catboost as cbt
 import xgboost as xgb
+import os
 import time
 from river import stream
 from statistics import mode
-
-def data_prep(data_path):
+import artifact_store
+from stage_timer import StageTimer
+import heatmap
+import datasets
+import metrics
+import preprocess
+import stage_cache
+
+# oversample=False skips SMOTE and returns None for X_train and y_train, for runs that only score the test set
+def data_prep(data_path, timer=None, compact=False, oversample=True):
+    timer = timer or StageTimer()
+    timer.reset()
 
     # ## Read the sampled CICIDS2017 dataset
     # The CICIDS2017 dataset is publicly available at: https://www.unb.ca/cic/datasets/ids-2017.html  
     # Due to the large size of this dataset, the sampled subsets of CICIDS2017 is used. The subsets are in the "data" folder.  
     # If you want to use this code on other datasets (e.g., CAN-intrusion dataset), just change the dataset name and follow the same steps. The models in this code are generic models that can be used in any intrusion detection/network traffic datasets.
 
-    # "./Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/CICIDS2017_sample_km.csv"
-    df = pd.read_csv(data_path)
-    
-    if 'CICIDS2017_sample_km.csv' in data_path:
-        df.Label.value_counts()
-        # ## Split train set and test set
-
-        X = df.drop(['Label'],axis=1)
-        y = df['Label']
-        X_train, X_test, y_train, y_test = train_test_split(X,y, train_size = 0.8, test_size = 0.2, random_state = 0) #shuffle=False
-
-        # ## SMOTE to solve class-imbalance
-        pd.Series(y_train).value_counts()
+    # How the dataset has to be prepared (normalization, label encoding, SMOTE targets) comes from the registry in datasets.py.
+    # The stages are memoized (stage_cache.py): a run on the same dataset and split loads their output.
+    ds = datasets.get(data_path)
+    prepared = stage_cache.prepared(ds, compact, timer)
 
-        from imblearn.over_sampling import SMOTE
-        smote=SMOTE(n_jobs=-1,sampling_strategy={2:1000,4:1000})
-
-        X_train, y_train = smote.fit_resample(X_train, y_train)
-
-        pd.Series(y_train).value_counts()
-    
-    elif 'CICIDS2017_sample.csv' in data_path:
-        numeric_features = df.dtypes[df.dtypes != 'object'].index
-        df[numeric_features] = df[numeric_features].apply(
-        lambda x: (x - x.min()) / (x.max()-x.min()))
+    # ## Split train set and test set
+    split = stage_cache.split(prepared, ds, 0.8, ds.stratify, compact=compact, timer=timer)
 
-        # Fill empty values by 0
-        df = df.fillna(0)
+    _, X_test, _, y_test = split.value
 
-        labelencoder = LabelEncoder()
-        df.iloc[:, -1] = labelencoder.fit_transform(df.iloc[:, -1])
-        X = df.drop(['Label'],axis=1)
-        y = df['Label']
-        #y = df.iloc[:, -1].values.reshape(-1,1)
-        #y=np.ravel(y)
-        X_train, X_test, y_train, y_test = train_test_split(X,y, train_size = 0.8, test_size = 0.2, random_state = 0,stratify = y)
+    # What was done to the raw columns, so new flow records can be scored the same way (see LCCDEScorer)
+    prep = stage_cache.preparation(prepared, timer).value
+    if not oversample:
+        return None, X_test, None, y_test, prep
 
-        X_train.shape
+    # ## SMOTE to solve class-imbalance
+    # e.g. {4:1500}: create samples until the minority class "4" has 1500
+    X_train, y_train = stage_cache.oversampled(split, ds.smote, timer).value
 
-        pd.Series(y_train).value_counts()
+    pd.Series(y_train).value_counts()
 
-        from imblearn.over_sampling import SMOTE
-        smote=SMOTE(n_jobs=-1,sampling_strategy={4:1500}) # Create 1500 samples for the minority class "4"
-
-        y_train = y_train.astype(int)
-        #y_train = np.array(y_train)
-        y_test = y_test.astype(int)
-        #y_test = np.array(y_test)
-        X_train, y_train = smote.fit_resample(X_train, y_train)
-
-        pd.Series(y_train).value_counts()
-        
-    return X_train, X_test, y_train, y_test
+    return X_train, X_test, y_train, y_test, prep
 
 
     # ## Machine Learning (ML) model training
     # ### Training three base learners: LightGBM, XGBoost, CatBoost
 
-def train_base(X_train, X_test, y_train, y_test, xgb_params, lg_params, cb_params):
-    global lg
-    global xg
-    global cb
-    
-    #time models
-    global start_time
-    start_time = time.time()
-
-    ##### Train the LightGBM algorithm #####
-    import lightgbm as lgb
-    lg = lgb.LGBMClassifier(**lg_params)
-    lg.fit(X_train, y_train)
-    y_pred = lg.predict(X_test)
-    print(classification_report(y_test,y_pred))
-    print("Accuracy of LightGBM: "+ str(accuracy_score(y_test, y_pred)))
-    print("Precision of LightGBM: "+ str(precision_score(y_test, y_pred, average='weighted')))
-    print("Recall of LightGBM: "+ str(recall_score(y_test, y_pred, average='weighted')))
-    print("Average F1 of LightGBM: "+ str(f1_score(y_test, y_pred, average='weighted')))
-    print("F1 of LightGBM for each type of attack: "+ str(f1_score(y_test, y_pred, average=None)))
-    lg_f1=f1_score(y_test, y_pred, average=None)
-
-    # Plot the confusion matrix
-    cm=confusion_matrix(y_test,y_pred)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show() #dont need rn
-
-    ##### Train the XGBoost algorithm #####
-    import xgboost as xgb
-    xg = xgb.XGBClassifier(**xgb_params)
-
-    X_train_x = X_train.values
-    X_test_x = X_test.values
-
-    xg.fit(X_train_x, y_train)
-
-    y_pred = xg.predict(X_test_x)
-    print(classification_report(y_test,y_pred))
-    print("Accuracy of XGBoost: "+ str(accuracy_score(y_test, y_pred)))
-    print("Precision of XGBoost: "+ str(precision_score(y_test, y_pred, average='weighted')))
-    print("Recall of XGBoost: "+ str(recall_score(y_test, y_pred, average='weighted')))
-    print("Average F1 of XGBoost: "+ str(f1_score(y_test, y_pred, average='weighted')))
-    print("F1 of XGBoost for each type of attack: "+ str(f1_score(y_test, y_pred, average=None)))
-    xg_f1=f1_score(y_test, y_pred, average=None)
-
-    # Plot the confusion matrix
-    cm=confusion_matrix(y_test,y_pred)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show() #dont need rn
-
-    ##### Train the CatBoost algorithm #####
-    import catboost as cbt
-    cb = cbt.CatBoostClassifier(verbose=0,boosting_type='Plain', **cb_params)
-    #cb = cbt.CatBoostClassifier()
-
-    cb.fit(X_train, y_train)
-    y_pred = cb.predict(X_test)
-    print(classification_report(y_test,y_pred))
-    print("Accuracy of CatBoost: "+ str(accuracy_score(y_test, y_pred)))
-    print("Precision of CatBoost: "+ str(precision_score(y_test, y_pred, average='weighted')))
-    print("Recall of CatBoost: "+ str(recall_score(y_test, y_pred, average='weighted')))
-    print("Average F1 of CatBoost: "+ str(f1_score(y_test, y_pred, average='weighted')))
-    print("F1 of CatBoost for each type of attack: "+ str(f1_score(y_test, y_pred, average=None)))
-    cb_f1=f1_score(y_test, y_pred, average=None)
-
-    # Plot the confusion matrix
-    cm=confusion_matrix(y_test,y_pred)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show() #dont need rn
-
-    # ## Proposed ensemble model: Leader Class and Confidence Decision Ensemble (LCCDE)
-    # LCCDE aims to achieve optimal model performance by identifying the best-performing base ML model with the highest prediction confidence for each class. 
-    # ### Find the best-performing (leading) model for each type of attack among the three ML models
-
-    # Leading model list for each class
-    global model
-    model=[]
-    for i in range(len(lg_f1)):
-        if max(lg_f1[i],xg_f1[i],cb_f1[i]) == lg_f1[i]:
-            model.append(lg)
-        elif max(lg_f1[i],xg_f1[i],cb_f1[i]) == xg_f1[i]:
-            model.append(xg)
-        else:
-            model.append(cb)
-    model
-
-    return lg_f1, xg_f1, cb_f1
+# Fit one base learner and predict the test set. Kept at module level so it can run in a worker process.
+# n_threads caps the learner's native thread pool (None keeps the library default).
+def fit_base_learner(name, params, X_train, y_train, X_test, n_threads=None):
+    start = time.perf_counter()
+    params = dict(params)
+    if name == 'LightGBM':
+        if n_threads is not None and 'n_jobs' not in params and 'num_threads' not in params:
+            params['n_jobs'] = n_threads
+        clf = lgb.LGBMClassifier(**params)
+        clf.fit(X_train, y_train)
+        y_pred = clf.predict(X_test)
+    elif name == 'XGBoost':
+        if n_threads is not None and 'n_jobs' not in params:
+            params['n_jobs'] = n_threads
+        clf = xgb.XGBClassifier(**params)
+        clf.fit(X_train.values, y_train)
+        y_pred = clf.predict(X_test.values)
+    elif name == 'CatBoost':
+        if n_threads is not None and 'thread_count' not in params:
+            params['thread_count'] = n_threads
+        clf = cbt.CatBoostClassifier(verbose=0,boosting_type='Plain', allow_writing_files=False, **params)
+        clf.fit(X_train, y_train)
+        y_pred = clf.predict(X_test)
+    else:
+        raise ValueError('Unknown base learner: ' + str(name))
+    return clf, np.ravel(y_pred), time.perf_counter() - start
+
+# Train the three base learners either one after another or at the same time in worker processes.
+# In parallel mode each worker gets an equal share of the cores so the native thread pools don't oversubscribe.
+# With fewer cores than learners the workers would only take turns on them and starting the pool costs more
+# than it saves, so the learners are fitted in this process instead.
+def fit_base_learners(X_train, X_test, y_train, xgb_params, lg_params, cb_params, parallel=False):
+    learners = [('LightGBM', lg_params), ('XGBoost', xgb_params), ('CatBoost', cb_params)]
+
+    if not parallel or (os.cpu_count() or 1) < len(learners):
+        return [fit_base_learner(name, params, X_train, y_train, X_test) for name, params in learners]
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    n_threads = max(1, (os.cpu_count() or 1) // len(learners))
+    # spawn rather than fork: forking after OpenMP has started in this process can deadlock the workers
+    with ProcessPoolExecutor(max_workers=len(learners), mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(fit_base_learner, name, params, X_train, y_train, X_test, n_threads) for name, params in learners]
+        return [f.result() for f in futures]
 
 # ## LCCDE Prediction
-def LCCDE(X_test, y_test, m1, m2, m3):
+def LCCDE(X_test, y_test, m1, m2, m3, model):
     i = 0
     t = []
     m = []
@@ -269,37 +192,301 @@ def LCCDE(X_test, y_test, m1, m2, m3):
         yp.append(y_pred) # Save the predicted classes for all tested samples
     return yt, yp
 
+# ## LCCDE Prediction (batch mode)
+# Same decision rules as LCCDE() above, but each base learner is called once on the whole test matrix
+# and the leader/confidence rules are applied with array operations instead of one row at a time.
+# The loop keeps l/pred_l/pro_l across rows (they are never reset), so the running state is
+# reproduced here with prefix scans to keep yt/yp identical to the row-by-row version.
+def LCCDE_batch(X_test, y_test, m1, m2, m3, model):
+    models = [m1, m2, m3]
+
+    # One predict_proba call per model
+    probas = [m.predict_proba(np.asarray(X_test)) for m in models]
+    yp = LCCDE_decide(models, probas, model)
+
+    yt = list(y_test)
+    return yt, yp.tolist()
+
+# The LCCDE decision rules applied to the class probabilities of the three base learners (see LCCDE_batch)
+def LCCDE_decide(models, probas, model):
+    # The predicted class of each model is its most confident class
+    preds = np.stack([np.asarray(m.classes_)[np.argmax(p, axis=1)].astype(int) for m, p in zip(models, probas)])
+    confs = np.stack([np.max(p, axis=1) for p in probas])
+    y_pred1, y_pred2, y_pred3 = preds
+    y_pred_p1, y_pred_p2, y_pred_p3 = confs
+
+    # Index (0 = LightGBM, 1 = XGBoost, 2 = CatBoost) of the leader model for each class
+    leader = np.array([next(k for k, m in enumerate(models) if m is lm) for lm in model])
+
+    n = preds.shape[1]
+    yp = np.full(n, -1, dtype=int)
+
+    # All three models agree
+    agree = (y_pred1 == y_pred2) & (y_pred2 == y_pred3)
+    yp[agree] = y_pred1[agree]
+
+    # Chained "y_pred1 != y_pred2 != y_pred3" is also true when only y_pred1 == y_pred3
+    diff = (y_pred1 != y_pred2) & (y_pred2 != y_pred3)
+
+    # Two predicted classes are the same: the majority class is always y_pred2 here,
+    # and its leader model's prediction is already in preds
+    two = ~agree & ~diff
+    yp[two] = preds[leader[y_pred2[two]], np.flatnonzero(two)]
+
+    d = np.flatnonzero(diff)
+    if d.size > 0:
+        # Which models are the leader of their own predicted class
+        match = np.stack([leader[preds[k, d]] == k for k in range(3)])
+        count = np.cumsum(match.sum(axis=0))    # len(l) after each row
+
+        # pred_l[0]: the first matched prediction ever seen
+        first = np.flatnonzero(count > 0)
+        if first.size > 0:
+            r = first[0]
+            pred_l0 = preds[np.argmax(match[:, r]), d[r]]
+
+        # pro_l: the last [p1, p2, p3] reset before the first match, then every matched confidence
+        matched_conf = np.where(match, confs[:, d], -np.inf).max(axis=0)
+        max_pro = np.maximum.accumulate(matched_conf)
+        empty = np.flatnonzero(count == 0)
+        if empty.size > 0:
+            max_pro = np.maximum(max_pro, confs[:, d[empty[-1]]].max())
+
+        if first.size > 0:
+            yp[d[count == 1]] = pred_l0
+
+        many = count >= 2
+        dm = d[many]
+        yp[dm] = np.where(max_pro[many] == y_pred_p1[dm], y_pred1[dm],
+                          np.where(max_pro[many] == y_pred_p2[dm], y_pred2[dm], y_pred3[dm]))
+
+        # No leader pair yet: the loop leaves y_pred unchanged from the previous row
+        last = np.where(yp != -1, np.arange(n), 0)
+        np.maximum.accumulate(last, out=last)
+        hold = d[count == 0]
+        yp[hold] = yp[last[hold]]
+        # The loop has no previous prediction before the first row; fall back to LightGBM
+        yp[hold[yp[hold] == -1]] = y_pred1[0]
+
+    return yp
+
+
+# One LCCDE run: holds the trained base learners, the leader model table and the timer.
+class LCCDERun:
+
+    def __init__(self, data_path, xgb_params, lg_params, cb_params, parallel=True, reuse_artifacts=True, compact=False):
+        self.data_path = data_path
+        self.xgb_params = xgb_params
+        self.lg_params = lg_params
+        self.cb_params = cb_params
+        self.parallel = parallel
+        self.reuse_artifacts = reuse_artifacts
+        self.compact = compact
+
+        self.lg = None
+        self.xg = None
+        self.cb = None
+        self.model = []
+        self.start_time = None
+        self.prep = None
+        self.timer = StageTimer()
+        self.artifact_key = None
+        self.from_artifact = False
+
+    # everything besides the dataset that decides what the trained learners look like
+    def artifact_params(self):
+        params = {'XGB': self.xgb_params, 'LightGBM': self.lg_params, 'CatBoost': self.cb_params}
+        if self.compact:
+            # learners trained on float32 data are kept apart from the float64 ones
+            params['preprocessing'] = {'compact': True}
+        return params
+
+    # ## Saved ensembles
+    # A run with the same dataset contents and parameters as an earlier one reuses its trained learners
+    def load_artifact(self):
+        self.artifact_key = artifact_store.artifact_key(
+            artifact_store.dataset_fingerprint(self.data_path), self.artifact_params())
+        if not self.reuse_artifacts:
+            return None
+        artifact = artifact_store.load(self.artifact_key)
+        if artifact is None:
+            return None
+        models, state = artifact
+        self.lg, self.xg, self.cb = models['LightGBM'], models['XGBoost'], models['CatBoost']
+        # the leader table is stored as model indices (0 = LightGBM, 1 = XGBoost, 2 = CatBoost)
+        base = [self.lg, self.xg, self.cb]
+        self.model = [base[k] for k in state['leader']]
+        self.prep = state.get('prep', self.prep)
+        self.from_artifact = True
+        print('Loaded LCCDE artifact ' + self.artifact_key)
+        return state['lg_f1'], state['xg_f1'], state['cb_f1']
+
+    def save_artifact(self, lg_f1, xg_f1, cb_f1):
+        base = [self.lg, self.xg, self.cb]
+        leader = [next(k for k, m in enumerate(base) if m is lm) for lm in self.model]
+        artifact_store.save(self.artifact_key,
+                            {'LightGBM': self.lg, 'XGBoost': self.xg, 'CatBoost': self.cb},
+                            {'leader': leader, 'lg_f1': lg_f1, 'xg_f1': xg_f1, 'cb_f1': cb_f1, 'prep': self.prep},
+                            {'model': 'LCCDE', 'dataset_path': self.data_path,
+                             'params': artifact_store.normalize_params(self.artifact_params())})
 
-# Implementing LCCDE
-def run_model(data_path, xgb_params, lg_params, cb_params):
-    X_train, X_test, y_train, y_test = data_prep(data_path)
-    lg_f1, xg_f1, cb_f1 = train_base(X_train, X_test, y_train, y_test, xgb_params, lg_params, cb_params)
-    yt, yp = LCCDE(X_test, y_test, m1 = lg, m2 = xg, m3 = cb)
-    end_time = time.time()
-    run_model_time = end_time - start_time
+    # ## Machine Learning (ML) model training
+    # ### Training three base learners: LightGBM, XGBoost, CatBoost
+    def train_base(self, X_train, X_test, y_train, y_test):
+        #time models
+        self.start_time = time.time()
+
+        self.timer.reset()
+        fitted = fit_base_learners(X_train, X_test, y_train, self.xgb_params, self.lg_params, self.cb_params, self.parallel)
+        # per-learner fit times are measured where the learner ran; fit_base_learners is the wall time of all three
+        self.timer.lap('fit_base_learners')
+        for name, (_, _, seconds) in zip(['LightGBM', 'XGBoost', 'CatBoost'], fitted):
+            self.timer.add('fit_' + name, seconds)
+        (lg, lg_pred, _), (xg, xg_pred, _), (cb, cb_pred, _) = fitted
+        self.lg, self.xg, self.cb = lg, xg, cb
+
+        ##### Evaluate the LightGBM algorithm #####
+        m = metrics.evaluate(y_test, lg_pred)
+        metrics.print_summary('LightGBM', m, per_class=True)
+        lg_f1 = m.f1_per_class
+        heatmap.plot_confusion_matrix(m.cm)
+
+        ##### Evaluate the XGBoost algorithm #####
+        m = metrics.evaluate(y_test, xg_pred)
+        metrics.print_summary('XGBoost', m, per_class=True)
+        xg_f1 = m.f1_per_class
+        heatmap.plot_confusion_matrix(m.cm)
+
+        ##### Evaluate the CatBoost algorithm #####
+        m = metrics.evaluate(y_test, cb_pred)
+        metrics.print_summary('CatBoost', m, per_class=True)
+        cb_f1 = m.f1_per_class
+        heatmap.plot_confusion_matrix(m.cm)
+
+        # ## Proposed ensemble model: Leader Class and Confidence Decision Ensemble (LCCDE)
+        # LCCDE aims to achieve optimal model performance by identifying the best-performing base ML model with the highest prediction confidence for each class. 
+        # ### Find the best-performing (leading) model for each type of attack among the three ML models
+
+        # Leading model list for each class
+        model=[]
+        for i in range(len(lg_f1)):
+            if max(lg_f1[i],xg_f1[i],cb_f1[i]) == lg_f1[i]:
+                model.append(lg)
+            elif max(lg_f1[i],xg_f1[i],cb_f1[i]) == xg_f1[i]:
+                model.append(xg)
+            else:
+                model.append(cb)
+        self.model = model
+        self.timer.lap('metrics')
+
+        return lg_f1, xg_f1, cb_f1
+
+    # Implementing LCCDE
+    # The artifact store is checked first: with a saved ensemble only the test split is needed, not SMOTE
+    def run(self):
+        with self.timer.stage('artifact_load'):
+            f1s = self.load_artifact()
+        X_train, X_test, y_train, y_test, prep = data_prep(self.data_path, self.timer, self.compact, oversample=f1s is None)
+        if self.prep is None:
+            self.prep = prep
+        if f1s is not None:
+            # only scoring is timed when the learners come from the artifact store
+            self.start_time = time.time()
+            lg_f1, xg_f1, cb_f1 = f1s
+        else:
+            lg_f1, xg_f1, cb_f1 = self.train_base(X_train, X_test, y_train, y_test)
+            with self.timer.stage('artifact_save'):
+                self.save_artifact(lg_f1, xg_f1, cb_f1)
+        with self.timer.stage('ensemble'):
+            yt, yp = LCCDE_batch(X_test, y_test, m1 = self.lg, m2 = self.xg, m3 = self.cb, model = self.model)
+        end_time = time.time()
+        run_model_time = end_time - self.start_time
     
-    accuracy = str(accuracy_score(yt, yp))
-    precision = str(precision_score(yt, yp, average='weighted'))
-    recall = str(recall_score(yt, yp, average='weighted'))
-    f1 = str(f1_score(yt, yp, average='weighted'))
-
-    # The performance of the proposed lCCDE model
-    print("Accuracy of LCCDE: "+ accuracy)
-    print("Precision of LCCDE: "+ precision)
-    print("Recall of LCCDE: "+ recall)
-    print("Average F1 of LCCDE: "+ f1)
-    print("F1 of LCCDE for each type of attack: "+ str(f1_score(yt, yp, average=None)))
-
-    # %%
-    # Comparison: The F1-scores for each base model
-    print("F1 of LightGBM for each type of attack: "+ str(lg_f1))
-    print("F1 of XGBoost for each type of attack: "+ str(xg_f1))
-    print("F1 of CatBoost for each type of attack: "+ str(cb_f1))
-
-    cm=confusion_matrix(yt,yp)
-
-    #format time, accuracy, prec, recall, f1
-    return (str(run_model_time), accuracy, precision, recall, f1, str(cm.tolist()))
+        # The performance of the proposed lCCDE model
+        m = metrics.evaluate(yt, yp)
+        metrics.print_summary('LCCDE', m, per_class=True)
+        accuracy = str(m.accuracy)
+        precision = str(m.precision)
+        recall = str(m.recall)
+        f1 = str(m.f1)
+
+        # %%
+        # Comparison: The F1-scores for each base model
+        print("F1 of LightGBM for each type of attack: "+ str(lg_f1))
+        print("F1 of XGBoost for each type of attack: "+ str(xg_f1))
+        print("F1 of CatBoost for each type of attack: "+ str(cb_f1))
+
+        self.timer.lap('metrics')
+
+        #format time, accuracy, prec, recall, f1
+        return (str(run_model_time), accuracy, precision, recall, f1, str(m.cm.tolist()))
+
+
+# ## Scoring new flows
+# Keeps a trained ensemble in memory and scores batches of CICIDS2017-shaped flow records with it.
+# Rows go through the same min-max scaling as in data_prep, using the statistics of the training dataset.
+class LCCDEScorer:
+
+    def __init__(self, lg, xg, cb, model, prep):
+        self.models = [lg, xg, cb]
+        self.model = model
+        self.prep = prep
+        self.columns = prep['columns']
+
+    @classmethod
+    def from_artifact(cls, key):
+        artifact = artifact_store.load(key)
+        if artifact is None:
+            raise ValueError('No saved LCCDE ensemble for artifact ' + str(key))
+        models, state = artifact
+        if state.get('prep') is None:
+            raise ValueError('Artifact ' + str(key) + ' was saved without preprocessing statistics; rerun it to score new flows')
+        base = [models['LightGBM'], models['XGBoost'], models['CatBoost']]
+        return cls(*base, [base[k] for k in state['leader']], state['prep'])
+
+    # rows: list of dicts keyed by feature name (extra keys such as 'Label' are ignored) or lists in column order
+    # normalized=True says the rows are already min-max scaled; it is required for runs on datasets that were
+    # stored normalized (e.g. CICIDS2017_sample_km.csv), whose scaling statistics are unknown
+    def transform(self, rows, normalized=False):
+        if len(rows) == 0:
+            raise ValueError('No rows to score')
+        if self.prep['min'] is None and not normalized:
+            raise ValueError('This run has no scaling statistics (its dataset was stored normalized); '
+                             'send min-max normalized rows with "normalized": true')
+        if isinstance(rows[0], dict):
+            for i, r in enumerate(rows):
+                missing = [c for c in self.columns if c not in r]
+                if missing:
+                    raise ValueError('Row ' + str(i) + ' is missing feature columns: ' + ', '.join(missing))
+            X = np.array([[r[c] for c in self.columns] for r in rows], dtype=float)
+        else:
+            X = np.array(rows, dtype=float).reshape(len(rows), -1)
+            if X.shape[1] != len(self.columns):
+                raise ValueError('Expected ' + str(len(self.columns)) + ' features per row, got ' + str(X.shape[1]))
+
+        if not normalized:
+            preprocess.minmax_apply(X, self.prep['min'], self.prep['max'])
+        return X
+
+    # returns the predicted classes and, for each row, the highest probability a base learner gave that class
+    def score(self, rows, normalized=False):
+        X = self.transform(rows, normalized)
+        probas = [m.predict_proba(X) for m in self.models]
+        yp = LCCDE_decide(self.models, probas, self.model)
+
+        col = [np.searchsorted(np.asarray(m.classes_).astype(int), yp) for m in self.models]
+        conf = np.max([p[np.arange(len(yp)), c] for p, c in zip(probas, col)], axis=0)
+
+        if self.prep['classes'] is not None:
+            labels = [self.prep['classes'][k] for k in yp]
+        else:
+            labels = yp.tolist()
+        return labels, yp.tolist(), conf.tolist()
+
+
+# Implementing LCCDE
+def run_model(data_path, xgb_params, lg_params, cb_params, parallel=True, reuse_artifacts=True, compact=False):
+    return LCCDERun(data_path, xgb_params, lg_params, cb_params, parallel, reuse_artifacts, compact).run()
 
 # %% [markdown]
 # **Conclusion**: The performance (F1-score) of the proposed LCCDE ensemble model on each type of attack detection is higher than any base ML model.
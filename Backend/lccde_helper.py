@@ -1,7 +1,12 @@
+import collections
 import datetime
 import sqlite3
+import threading
+import time
 import lccde
 import json
+import artifact_store
+import stage_timer
 
 default_params = {
     "XGB": {
@@ -36,18 +41,67 @@ def run(json_req):
     path = './Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/'
     dataset_path = str(json_req["model_req"]["dataset_path"])
     dataset = path + dataset_path
+    #optional: keep features as float32 / labels as small ints during preprocessing
+    compact = json_req["model_req"].get("compact", False) in (True, 1, 'true', 'True', '1')
     #run model
-    result = lccde.run_model(dataset, xgb_params, lg_params, cb_params)
+    lccde_run = lccde.LCCDERun(dataset, xgb_params, lg_params, cb_params, compact=compact)
+    result = lccde_run.run()
+    stage_timings = lccde_run.timer.as_dict()
 
     #create json
-    result_json = parse_to_json(result)
+    result_json = parse_to_json(result, stage_timings)
 
-    #store results
-    record(result, xgb_params, lg_params, cb_params, dataset_path)
+    #store results and link the saved ensemble to the new run
+    run_id = record(result, xgb_params, lg_params, cb_params, dataset_path)
+    stage_timer.record(run_id, 'LCCDE', stage_timings)
+    artifact_store.link_run(lccde_run.artifact_key, run_id)
     
     return result_json
     #return json result
 
+#scorers for recently used runs stay loaded so repeated /scoreLccde calls skip loading the models
+MAX_WARM_SCORERS = 4
+_scorers = collections.OrderedDict()
+_scorers_lock = threading.Lock()
+
+def get_scorer(run_id):
+    with _scorers_lock:
+        if run_id in _scorers:
+            _scorers.move_to_end(run_id)
+            return _scorers[run_id]
+
+    key = artifact_store.find_by_run(run_id)
+    if key is None:
+        raise ValueError('No saved LCCDE ensemble for run ' + str(run_id))
+    scorer = lccde.LCCDEScorer.from_artifact(key)
+
+    with _scorers_lock:
+        _scorers[run_id] = scorer
+        _scorers.move_to_end(run_id)
+        while len(_scorers) > MAX_WARM_SCORERS:
+            _scorers.popitem(last=False)
+    return scorer
+
+#score a batch of flow records with the ensemble of an earlier run
+def score(json_req):
+    run_id = int(json_req["run_id"])
+    rows = json_req["rows"]
+    #rows that are already min-max normalized (needed for runs on datasets stored normalized)
+    normalized = json_req.get("normalized", False) in (True, 1, 'true', 'True', '1')
+    scorer = get_scorer(run_id)
+
+    start = time.time()
+    labels, classes, confidences = scorer.score(rows, normalized)
+    elapsed_ms = (time.time() - start) * 1000
+
+    return json.dumps({"score_results": {
+        "run_id": run_id,
+        "labels": labels,
+        "classes": classes,
+        "confidences": confidences,
+        "scoring_time_ms": elapsed_ms
+    }})
+
 #fill the json will default parameters if they empty
 def default_fill(json_req, default):
     #print(json) #before
@@ -80,6 +134,7 @@ def get_runs():
 
     c.close()
     connection.close()
+    timings = stage_timer.get_all('LCCDE')
     #parse json
     
     rows_dict = { "rows" : [] }
@@ -101,6 +156,7 @@ def get_runs():
         row_dict['CatBoost'] = {}
         for i, key in enumerate(CB_keys):
             row_dict['CatBoost'][key] = r[i + idx_offset]
+        row_dict['stage_timings'] = timings.get(row_dict['id'], {})
         rows_dict["rows"].append(row_dict)
 
     #print(rows_dict)
@@ -126,17 +182,21 @@ def record(result, xgb_params, lg_params, cb_params, dataset_path):
     print(record)
 
     c.execute("INSERT INTO LCCDE (duration, accuracy, prec, recall, f1_score, heatmap_data, xgb_n_estimators, xgb_max_depth, xgb_learning_rate, lg_num_iterations, lg_max_depth, lg_learning_rate, lg_num_leaves, lg_boosting_type, cb_n_estimators, cb_max_depth, cb_learning_rate, run_date, dataset_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (record))
+    #the insert trigger renumbers the row to the new RunHistory id; read it before committing (the write lock is still held)
+    c.execute("SELECT MAX(run_id) FROM RunHistory")
+    run_id = c.fetchone()[0]
     connection.commit()
 
     c.close()
     connection.close()
+    return run_id
 
 #read from db function? how are we searching
 # def read():
 #     pass
 
 #decode/parse json function?
-def parse_to_json(result):
+def parse_to_json(result, stage_timings=None):
     keys = ['execution_time', 'accuracy', 'precision', 'recall', 'f1', 'heatmap']
     json_result = {"model_results": {}}
 
@@ -145,6 +205,7 @@ def parse_to_json(result):
             json_result["model_results"][key] = None
         else:
             json_result["model_results"][key] = result[idx]
+    json_result["model_results"]["stage_timings"] = stage_timings
     
     json_result = json.dumps(json_result)
     return json_result
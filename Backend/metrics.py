@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+
+# Evaluation for the model files. The confusion matrix is counted once (one bincount over the
+# encoded label pairs) and accuracy, weighted precision/recall/F1 and the per-class scores are all
+# derived from it, instead of calling accuracy_score, precision_recall_fscore_support,
+# classification_report and confusion_matrix one after another on the same predictions.
+# Numbers match sklearn (labels are the sorted union of y_true and y_pred, 0 where undefined).
+# The classification_report style text is only built on request; IDS_METRIC_REPORTS=1 prints it
+# after every evaluation like the model files used to.
+REPORTS = os.environ.get('IDS_METRIC_REPORTS', '0') == '1'
+
+
+class Metrics:
+
+    def __init__(self, cm, labels):
+        self.cm = cm
+        self.labels = labels
+
+        cm = cm.astype(np.float64)
+        tp = np.diag(cm)
+        self.support = cm.sum(axis=1)
+        predicted = cm.sum(axis=0)
+        self.n = self.support.sum()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.precision_per_class = np.where(predicted > 0, tp / predicted, 0.0)
+            self.recall_per_class = np.where(self.support > 0, tp / self.support, 0.0)
+            denom = self.support + predicted
+            self.f1_per_class = np.where(denom > 0, 2 * tp / denom, 0.0)
+
+        self.accuracy = float(tp.sum() / self.n) if self.n else 0.0
+        self.precision = self.weighted(self.precision_per_class)
+        self.recall = self.weighted(self.recall_per_class)
+        self.f1 = self.weighted(self.f1_per_class)
+
+    def weighted(self, per_class):
+        if not self.n:
+            return 0.0
+        return float(np.dot(per_class, self.support) / self.n)
+
+    #text in the layout of sklearn's classification_report
+    def report(self, digits=2):
+        names = [str(label) for label in self.labels]
+        width = max([len(name) for name in names] + [len('weighted avg'), digits])
+        headers = ['precision', 'recall', 'f1-score', 'support']
+        fmt = '{:>{width}s} ' + ' {:>9}' * len(headers) + '\n'
+        row_fmt = '{:>{width}s} ' + ' {:>9.{digits}f}' * 3 + ' {:>9}\n'
+
+        text = fmt.format('', *headers, width=width) + '\n'
+        for i, name in enumerate(names):
+            text += row_fmt.format(name, self.precision_per_class[i], self.recall_per_class[i],
+                                   self.f1_per_class[i], int(self.support[i]), width=width, digits=digits)
+        text += '\n'
+        text += ('{:>{width}s} ' + ' {:>9}' * 2 + ' {:>9.{digits}f} {:>9}\n').format(
+            'accuracy', '', '', self.accuracy, int(self.n), width=width, digits=digits)
+        text += row_fmt.format('macro avg', float(np.mean(self.precision_per_class)), float(np.mean(self.recall_per_class)),
+                               float(np.mean(self.f1_per_class)), int(self.n), width=width, digits=digits)
+        text += row_fmt.format('weighted avg', self.precision, self.recall, self.f1, int(self.n), width=width, digits=digits)
+        return text
+
+
+#confusion matrix (rows true, columns predicted) and the labels it is indexed by
+def confusion(y_true, y_pred, labels=None):
+    y_true = np.ravel(np.asarray(y_true))
+    y_pred = np.ravel(np.asarray(y_pred))
+    if labels is None:
+        labels, codes = np.unique(np.concatenate([y_true, y_pred]), return_inverse=True)
+        true_codes, pred_codes = codes[:len(y_true)], codes[len(y_true):]
+    else:
+        labels = np.asarray(labels)
+        order = np.argsort(labels)
+        true_codes = order[np.searchsorted(labels, y_true, sorter=order)]
+        pred_codes = order[np.searchsorted(labels, y_pred, sorter=order)]
+    k = len(labels)
+    cm = np.bincount(true_codes * k + pred_codes, minlength=k * k).reshape(k, k)
+    return cm, labels
+
+def evaluate(y_true, y_pred, labels=None):
+    cm, labels = confusion(y_true, y_pred, labels)
+    return Metrics(cm, labels)
+
+#the accuracy/precision/recall/F1 lines the model files print after each learner
+def print_summary(name, m, per_class=False):
+    print('Accuracy of ' + name + ': ' + str(m.accuracy))
+    print('Precision of ' + name + ': ' + str(m.precision))
+    print('Recall of ' + name + ': ' + str(m.recall))
+    print('F1-score of ' + name + ': ' + str(m.f1))
+    if per_class:
+        print('F1 of ' + name + ' for each type of attack: ' + str(m.f1_per_class))
+    if REPORTS:
+        print(m.report())
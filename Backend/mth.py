@@ -13,16 +13,23 @@ warnings.filterwarnings("ignore")
 
 import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report,confusion_matrix,accuracy_score,precision_recall_fscore_support
+from sklearn.metrics import classification_report,confusion_matrix,accuracy_score
 from sklearn.metrics import f1_score,roc_auc_score
 from sklearn.ensemble import RandomForestClassifier,ExtraTreesClassifier
 from sklearn.tree import DecisionTreeClassifier
 import xgboost as xgb
 from xgboost import plot_importance
+from stage_timer import StageTimer
+import heatmap
+import hpo
+import dataset_cache
+import datasets
+import feature_ranking
+import metrics
+import preprocess
+import resampling
+import stage_cache
+import task_graph
 
 
 # %% [markdown]
@@ -56,6 +63,7 @@ from xgboost import plot_importance
 # # %% [markdown]
 # # ### Data sampling
 # # Due to the space limit of GitHub files and the large size of network traffic data, we sample a small-sized subset for model learning using **k-means cluster sampling**
+# # (runnable version: kmeans_sampling.py)
 
 # # %%
 # labelencoder = LabelEncoder()
@@ -122,42 +130,29 @@ from xgboost import plot_importance
 #  ### split train set and test set
 
 
-def preprocessing(dataset_path, train_split):
-    # Read the sampled dataset
-
-    df = pd.read_csv(dataset_path)
-    features = df.dtypes[df.dtypes != 'object'].index
-
-    if 'CICIDS2017_sample_km.csv' in dataset_path:
-        X = df.drop(['Label'],axis=1).values
-        y = df.iloc[:, -1].values.reshape(-1,1)
-        y=np.ravel(y)
-
-        X_train, X_test, y_train, y_test = train_test_split(X,y, train_size = train_split, test_size = (1 - train_split), random_state = 0,stratify = y)
-        
-    elif 'CICIDS2017_sample.csv' in dataset_path:
-        numeric_features = df.dtypes[df.dtypes != 'object'].index
-        df[numeric_features] = df[numeric_features].apply(
-        lambda x: (x - x.min()) / (x.max()-x.min()))
-
-        # Fill empty values by 0
-        df = df.fillna(0)
-
-        labelencoder = LabelEncoder()
-        df.iloc[:, -1] = labelencoder.fit_transform(df.iloc[:, -1])
-        X = df.drop(['Label'],axis=1)
-        y = df.iloc[:, -1].values.reshape(-1,1)
-        y=np.ravel(y)
-
-        X_train, X_test, y_train, y_test = train_test_split(X,y, train_size = 0.8, test_size = 0.2, random_state = 0,stratify = y)
-
-        y_train = y_train.astype(int)
-        X_train = X_train.values
+def preprocessing(dataset_path, train_split, timer=None, compact=False, feature_selector='fcbfk', fcbf_pieces=2,
+                  mi_estimator=None):
+    timer = timer or StageTimer()
+    timer.reset()
+    # Read the sampled dataset; datasets.py says how it has to be prepared. Every stage up to SMOTE is
+    # memoized (stage_cache.py), so e.g. a run with only another hpo_max_evals loads the SMOTE output
+    ds = datasets.get(dataset_path)
+    prepared = stage_cache.prepared(ds, compact, timer)
+    split = stage_cache.split(prepared, ds, train_split, compact=compact, timer=timer)
 
 #  ## Feature engineering
 #  ### Feature selection by information gain
-    from sklearn.feature_selection import mutual_info_classif
-    importances = mutual_info_classif(X_train, y_train)
+    #  feature_ranking.py estimates the MI from binned features ('binned') or with the k-NN estimator ('knn');
+    #  the importances are stored per dataset, split and estimator
+    mi_estimator = mi_estimator or feature_ranking.ESTIMATOR
+    if mi_estimator not in feature_ranking.ESTIMATORS:
+        raise ValueError('Unknown mi_estimator: ' + str(mi_estimator) + ' (binned or knn)')
+    def mutual_info():
+        X_train, _, y_train, _ = split.value
+        return feature_ranking.mutual_info(X_train.values, y_train.values, mi_estimator)
+    importances = stage_cache.run('mutual_info', [split], feature_ranking.params(mi_estimator), mutual_info,
+                                  timer=timer, lap='feature_selection_mi').value
+    features = stage_cache.preparation(prepared).value['columns']
 
     # calculate the sum of importance scores
     f_list = sorted(zip(map(lambda x: round(x, 4), importances), features), reverse=True)
@@ -177,34 +172,35 @@ def preprocessing(dataset_path, train_split):
         if Sum2>=0.9:
             break        
 
-    X_fs = df[fs].values
-    X_fs.shape
-
     #  ### Feature selection by Fast Correlation Based Filter (FCBF)
     #  The module is imported from the GitHub repo: https://github.com/SantiagoEG/FCBF_module
-    from FCBF_module.FCBF_module import FCBF, FCBFK, FCBFiP, get_i
-    fcbf = FCBFK(k = 20)
-    #fcbf.fit(X_fs, y)
-    X_fss = fcbf.fit_transform(X_fs,y)
-    X_fss.shape
+    #  feature_selector='fcbfip' uses FCBF in pieces (fcbf_pieces pieces, processed in parallel), for wide datasets
+    if feature_selector not in ('fcbfk', 'fcbfip'):
+        raise ValueError('Unknown feature_selector: ' + str(feature_selector) + ' (fcbfk or fcbfip)')
+    def fcbf_select():
+        from FCBF_module.FCBF_module import FCBF, FCBFK, FCBFiP, get_i
+        df = prepared.value[0]
+        X_fs = df[fs].values
+        y = preprocess.labels(df[ds.label].values, compact)
+        if feature_selector == 'fcbfip':
+            fcbf = FCBFiP(k = 20, npieces = fcbf_pieces)
+        else:
+            fcbf = FCBFK(k = 20)
+        fcbf.fit(X_fs, y)
+        return [fs[i] for i in fcbf.idx_sel]
+    params = {'features': fs, 'k': 20, 'compact': compact, 'selector': feature_selector}
+    if feature_selector == 'fcbfip':
+        params['pieces'] = fcbf_pieces
+    fss = stage_cache.run('fcbf', [prepared], params, fcbf_select, timer=timer, lap='feature_selection_fcbf').value
 
     #  ### Re-split train & test sets after feature selection
-    X_train, X_test, y_train, y_test = train_test_split(X_fss,y, train_size = train_split, test_size = (1 - train_split), random_state = 0,stratify = y)
-    X_train.shape
+    split = stage_cache.split(prepared, ds, train_split, columns=fss, compact=compact, timer=timer)
 
-    pd.Series(y_train).value_counts()
-
-    from imblearn.over_sampling import SMOTE
     #  ### SMOTE to solve class-imbalance
-    if 'CICIDS2017_sample_km.csv' in dataset_path:
-        smote=SMOTE(n_jobs=-1,sampling_strategy={2:1000,4:1000})
-    
-    elif 'CICIDS2017_sample.csv' in dataset_path:
-        smote=SMOTE(n_jobs=-1,sampling_strategy={4:1500})#####
-        y_train = y_train.astype(int)
-        y_test = y_test.astype(int)
-
-    X_train, y_train = smote.fit_resample(X_train, y_train)
+    X_train, y_train = stage_cache.oversampled(split, ds.smote, timer).value
+    _, X_test, _, y_test = split.value
+    X_train, X_test = np.asarray(X_train), np.asarray(X_test)
+    y_train, y_test = np.asarray(y_train), np.asarray(y_test)
 
     pd.Series(y_train).value_counts()
 
@@ -216,50 +212,49 @@ def preprocessing(dataset_path, train_split):
 #  ## Machine learning model training
 #  ### Training four base learners: decision tree, random forest, extra trees, XGBoost
 #  #### Apply XGBoost
-def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
-    #time models
-    global start_time
-    start_time = time.time()
+def xgboost_branch(X_train, X_test, y_train, y_test, max_features, hpo_max_evals, hpo_parallelism=None, hpo_mode=None, timer=None,
+                   n_jobs=None):
+    timer = timer or StageTimer()
+    timer.reset()
 
-    xg = xgb.XGBClassifier(n_estimators = 10)
+    xg = xgb.XGBClassifier(n_estimators = 10, n_jobs = n_jobs)
     xg.fit(X_train,y_train)
-    xg_score=xg.score(X_test,y_test)
+    timer.lap('fit_XGBoost')
     y_predict=xg.predict(X_test)
     y_true=y_test
-    print('Accuracy of XGBoost: '+ str(xg_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of XGBoost: '+(str(precision)))
-    print('Recall of XGBoost: '+(str(recall)))
-    print('F1-score of XGBoost: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('XGBoost', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics')
 
 
 
     #  #### Hyperparameter optimization (HPO) of XGBoost using Bayesian optimization with tree-based Parzen estimator (BO-TPE)
     #  Based on the GitHub repo for HPO: https://github.com/LiYangHart/Hyperparameter-Optimization-of-Machine-Learning-Algorithms
+    #  hpo.fmin evaluates hpo_parallelism trials at a time in worker processes; the objectives get the
+    #  arrays as arguments so the workers can read them from memory-mapped files
+    #  hpo_mode='halving' replaces TPE with successive halving over training subsamples
+    #  finished trials are kept in trial_store.py: repeated parameter sets aren't refitted and a new search
+    #  on the same data continues from the earlier trials
+    #  the objectives return their fitted model and test predictions; when the winning trial ran in this
+    #  process hpo.fmin hands them back in `kept` and the model isn't trained a second time
 
 
-    from hyperopt import hp, fmin, tpe, STATUS_OK, Trials
-    from sklearn.model_selection import cross_val_score, StratifiedKFold
-    def objective(params):
+    from hyperopt import hp, STATUS_OK
+    def objective(params, X_train, X_test, y_train, y_test):
         params = {
             'n_estimators': int(params['n_estimators']), 
             'max_depth': int(params['max_depth']),
             'learning_rate':  abs(float(params['learning_rate'])),
 
         }
-        clf = xgb.XGBClassifier( **params)
+        clf = xgb.XGBClassifier( **params, n_jobs = n_jobs)
         clf.fit(X_train, y_train)
         y_pred = clf.predict(X_test)
         score = accuracy_score(y_test, y_pred)
 
-        return {'loss':-score, 'status': STATUS_OK }
+        return {'loss':-score, 'status': STATUS_OK, 'model': clf, 'y_pred': y_pred }
 
     space = {
         'n_estimators': hp.quniform('n_estimators', 10, 100, 5),
@@ -267,10 +262,10 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
         'learning_rate': hp.normal('learning_rate', 0.01, 0.9),
     }
 
-    best = fmin(fn=objective,
-                space=space,
-                algo=tpe.suggest,
-                max_evals=hpo_max_evals)
+    kept = {}
+    best = hpo.fmin(objective, space, hpo_max_evals, (X_train, X_test, y_train, y_test), hpo_parallelism, hpo_mode,
+                    family='XGBoost', kept=kept)
+    timer.lap('hpo_XGBoost')
     print("XGBoost: Hyperopt estimated optimum {}".format(best))
 
     best['n_estimators'] = int(best['n_estimators'])
@@ -278,51 +273,43 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
     best['learning_rate'] = abs(best['learning_rate'])
 
     #xg = xgb.XGBClassifier(learning_rate= 0.7340229699980686, n_estimators = 70, max_depth = 14)
-    xg = xgb.XGBClassifier(**best)
-    xg.fit(X_train,y_train)
-    xg_score=xg.score(X_test,y_test)
-    y_predict=xg.predict(X_test)
+    if kept:
+        xg, y_predict = kept['model'], kept['y_pred']
+    else:
+        xg = xgb.XGBClassifier(**best, n_jobs = n_jobs)
+        xg.fit(X_train,y_train)
+        timer.lap('fit_XGBoost')
+        y_predict=xg.predict(X_test)
     y_true=y_test
-    print('Accuracy of XGBoost: '+ str(xg_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of XGBoost: '+(str(precision)))
-    print('Recall of XGBoost: '+(str(recall)))
-    print('F1-score of XGBoost: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('XGBoost', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics')
 
 
 
     xg_train=xg.predict(X_train)
-    xg_test=xg.predict(X_test)
-
+    xg_test=y_predict
+    timer.lap('ensemble')
 
+    return xg_train, xg_test
 
-    #  #### Apply RF
-
+#  #### Apply RF
+def rf_branch(X_train, X_test, y_train, y_test, max_features, hpo_max_evals, hpo_parallelism=None, hpo_mode=None, timer=None):
+    timer = timer or StageTimer()
+    timer.reset()
 
     rf = RandomForestClassifier(random_state = 0)
     rf.fit(X_train,y_train) 
-    rf_score=rf.score(X_test,y_test)
+    timer.lap('fit_RF')
     y_predict=rf.predict(X_test)
     y_true=y_test
-    print('Accuracy of RF: '+ str(rf_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of RF: '+(str(precision)))
-    print('Recall of RF: '+(str(recall)))
-    print('F1-score of RF: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('RF', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics')
 
 
 
@@ -331,10 +318,9 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
 
 
     # Hyperparameter optimization of random forest
-    from hyperopt import hp, fmin, tpe, STATUS_OK, Trials
-    from sklearn.model_selection import cross_val_score, StratifiedKFold
+    from hyperopt import hp, STATUS_OK
     # Define the objective function
-    def objective(params):
+    def objective(params, X_train, X_test, y_train, y_test):
         params = {
             'n_estimators': int(params['n_estimators']), 
             'max_depth': int(params['max_depth']),
@@ -345,9 +331,10 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
         }
         clf = RandomForestClassifier( **params)
         clf.fit(X_train,y_train)
-        score=clf.score(X_test,y_test)
+        y_pred=clf.predict(X_test)
+        score=accuracy_score(y_test,y_pred)
 
-        return {'loss':-score, 'status': STATUS_OK }
+        return {'loss':-score, 'status': STATUS_OK, 'model': clf, 'y_pred': y_pred }
     # Define the hyperparameter configuration space
     space = {
         'n_estimators': hp.quniform('n_estimators', 10, 200, 1),
@@ -358,10 +345,10 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
         "criterion":hp.choice('criterion',['gini','entropy'])
     }
 
-    best = fmin(fn=objective,
-                space=space,
-                algo=tpe.suggest,
-                max_evals=hpo_max_evals)
+    kept = {}
+    best = hpo.fmin(objective, space, hpo_max_evals, (X_train, X_test, y_train, y_test), hpo_parallelism, hpo_mode,
+                    family='RF', kept=kept)
+    timer.lap('hpo_RF')
     print("Random Forest: Hyperopt estimated optimum {}".format(best))
 
     best['n_estimators'] = int(best['n_estimators'])
@@ -372,51 +359,43 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
     best['criterion'] = 'gini' if best['criterion'] == 0 else 'entropy'
 
     #rf_hpo = RandomForestClassifier(n_estimators = 71, min_samples_leaf = 1, max_depth = 46, min_samples_split = 9, max_features = 20, criterion = 'entropy')
-    rf_hpo = RandomForestClassifier(**best)
-    rf_hpo.fit(X_train,y_train)
-    rf_score=rf_hpo.score(X_test,y_test)
-    y_predict=rf_hpo.predict(X_test)
+    if kept:
+        rf_hpo, y_predict = kept['model'], kept['y_pred']
+    else:
+        rf_hpo = RandomForestClassifier(**best)
+        rf_hpo.fit(X_train,y_train)
+        timer.lap('fit_RF')
+        y_predict=rf_hpo.predict(X_test)
     y_true=y_test
-    print('Accuracy of RF: '+ str(rf_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of RF: '+(str(precision)))
-    print('Recall of RF: '+(str(recall)))
-    print('F1-score of RF: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('RF', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics')
 
 
 
     rf_train=rf_hpo.predict(X_train)
-    rf_test=rf_hpo.predict(X_test)
+    rf_test=y_predict
+    timer.lap('ensemble')
 
+    return rf_train, rf_test
 
-
-    #  #### Apply DT
-
+#  #### Apply DT
+def dt_branch(X_train, X_test, y_train, y_test, max_features, hpo_max_evals, hpo_parallelism=None, hpo_mode=None, timer=None):
+    timer = timer or StageTimer()
+    timer.reset()
 
     dt = DecisionTreeClassifier(random_state = 0)
     dt.fit(X_train,y_train) 
-    dt_score=dt.score(X_test,y_test)
+    timer.lap('fit_DT')
     y_predict=dt.predict(X_test)
     y_true=y_test
-    print('Accuracy of DT: '+ str(dt_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of DT: '+(str(precision)))
-    print('Recall of DT: '+(str(recall)))
-    print('F1-score of DT: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('DT', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics')
 
 
 
@@ -425,10 +404,9 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
 
 
     # Hyperparameter optimization of decision tree
-    from hyperopt import hp, fmin, tpe, STATUS_OK, Trials
-    from sklearn.model_selection import cross_val_score, StratifiedKFold
+    from hyperopt import hp, STATUS_OK
     # Define the objective function
-    def objective(params):
+    def objective(params, X_train, X_test, y_train, y_test):
         params = {
             'max_depth': int(params['max_depth']),
             'max_features': int(params['max_features']),
@@ -438,9 +416,10 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
         }
         clf = DecisionTreeClassifier( **params)
         clf.fit(X_train,y_train)
-        score=clf.score(X_test,y_test)
+        y_pred=clf.predict(X_test)
+        score=accuracy_score(y_test,y_pred)
 
-        return {'loss':-score, 'status': STATUS_OK }
+        return {'loss':-score, 'status': STATUS_OK, 'model': clf, 'y_pred': y_pred }
     # Define the hyperparameter configuration space
     space = {
         'max_depth': hp.quniform('max_depth', 5, 50, 1),
@@ -450,10 +429,10 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
         "criterion":hp.choice('criterion',['gini','entropy'])
     }
 
-    best = fmin(fn=objective,
-                space=space,
-                algo=tpe.suggest,
-                max_evals=hpo_max_evals)
+    kept = {}
+    best = hpo.fmin(objective, space, hpo_max_evals, (X_train, X_test, y_train, y_test), hpo_parallelism, hpo_mode,
+                    family='DT', kept=kept)
+    timer.lap('hpo_DT')
     print("Decision tree: Hyperopt estimated optimum {}".format(best))
 
     best['max_depth'] = int(best['max_depth'])
@@ -463,51 +442,43 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
     best['criterion'] = 'gini' if best['criterion'] == 0 else 'entropy'
 
     #dt_hpo = DecisionTreeClassifier(min_samples_leaf = 2, max_depth = 47, min_samples_split = 3, max_features = 19, criterion = 'gini')
-    dt_hpo = DecisionTreeClassifier(**best)
-    dt_hpo.fit(X_train,y_train)
-    dt_score=dt_hpo.score(X_test,y_test)
-    y_predict=dt_hpo.predict(X_test)
+    if kept:
+        dt_hpo, y_predict = kept['model'], kept['y_pred']
+    else:
+        dt_hpo = DecisionTreeClassifier(**best)
+        dt_hpo.fit(X_train,y_train)
+        timer.lap('fit_DT')
+        y_predict=dt_hpo.predict(X_test)
     y_true=y_test
-    print('Accuracy of DT: '+ str(dt_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of DT: '+(str(precision)))
-    print('Recall of DT: '+(str(recall)))
-    print('F1-score of DT: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('DT', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics')
 
 
 
     dt_train=dt_hpo.predict(X_train)
-    dt_test=dt_hpo.predict(X_test)
+    dt_test=y_predict
+    timer.lap('ensemble')
 
+    return dt_train, dt_test
 
-
-    #  #### Apply ET
-
+#  #### Apply ET
+def et_branch(X_train, X_test, y_train, y_test, max_features, hpo_max_evals, hpo_parallelism=None, hpo_mode=None, timer=None):
+    timer = timer or StageTimer()
+    timer.reset()
 
     et = ExtraTreesClassifier(random_state = 0)
     et.fit(X_train,y_train) 
-    et_score=et.score(X_test,y_test)
+    timer.lap('fit_ET')
     y_predict=et.predict(X_test)
     y_true=y_test
-    print('Accuracy of ET: '+ str(et_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of ET: '+(str(precision)))
-    print('Recall of ET: '+(str(recall)))
-    print('F1-score of ET: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('ET', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics')
 
 
 
@@ -516,10 +487,9 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
 
 
     # Hyperparameter optimization of extra trees
-    from hyperopt import hp, fmin, tpe, STATUS_OK, Trials
-    from sklearn.model_selection import cross_val_score, StratifiedKFold
+    from hyperopt import hp, STATUS_OK
     # Define the objective function
-    def objective(params):
+    def objective(params, X_train, X_test, y_train, y_test):
         params = {
             'n_estimators': int(params['n_estimators']), 
             'max_depth': int(params['max_depth']),
@@ -530,9 +500,10 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
         }
         clf = ExtraTreesClassifier( **params)
         clf.fit(X_train,y_train)
-        score=clf.score(X_test,y_test)
+        y_pred=clf.predict(X_test)
+        score=accuracy_score(y_test,y_pred)
 
-        return {'loss':-score, 'status': STATUS_OK }
+        return {'loss':-score, 'status': STATUS_OK, 'model': clf, 'y_pred': y_pred }
     # Define the hyperparameter configuration space
     space = {
         'n_estimators': hp.quniform('n_estimators', 10, 200, 1),
@@ -543,10 +514,10 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
         "criterion":hp.choice('criterion',['gini','entropy'])
     }
 
-    best = fmin(fn=objective,
-                space=space,
-                algo=tpe.suggest,
-                max_evals=hpo_max_evals)
+    kept = {}
+    best = hpo.fmin(objective, space, hpo_max_evals, (X_train, X_test, y_train, y_test), hpo_parallelism, hpo_mode,
+                    family='ET', kept=kept)
+    timer.lap('hpo_ET')
     print("Random Forest: Hyperopt estimated optimum {}".format(best))
 
     best['n_estimators'] = int(best['n_estimators'])
@@ -557,32 +528,35 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
     best['criterion'] = 'gini' if best['criterion'] == 0 else 'entropy'
 
     #et_hpo = ExtraTreesClassifier(n_estimators = 53, min_samples_leaf = 1, max_depth = 31, min_samples_split = 5, max_features = 20, criterion = 'entropy')
-    et_hpo = ExtraTreesClassifier(**best)
-    et_hpo.fit(X_train,y_train) 
-    et_score=et_hpo.score(X_test,y_test)
-    y_predict=et_hpo.predict(X_test)
+    if kept:
+        et_hpo, y_predict = kept['model'], kept['y_pred']
+    else:
+        et_hpo = ExtraTreesClassifier(**best)
+        et_hpo.fit(X_train,y_train) 
+        timer.lap('fit_ET')
+        y_predict=et_hpo.predict(X_test)
     y_true=y_test
-    print('Accuracy of ET: '+ str(et_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of ET: '+(str(precision)))
-    print('Recall of ET: '+(str(recall)))
-    print('F1-score of ET: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('ET', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics')
 
 
 
     et_train=et_hpo.predict(X_train)
-    et_test=et_hpo.predict(X_test)
+    et_test=y_predict
+    timer.lap('ensemble')
 
+    return et_train, et_test
 
+#  ### Apply Stacking
+def stacking(y_train, y_test, hpo_max_evals, hpo_parallelism=None, hpo_mode=None, timer=None, dt=None, et=None, rf=None, xg=None,
+             n_jobs=None):
+    timer = timer or StageTimer()
+    timer.reset()
+    (dt_train, dt_test), (et_train, et_test), (rf_train, rf_test), (xg_train, xg_test) = dt, et, rf, xg
 
-    #  ### Apply Stacking
     #  The ensemble model that combines the four ML models (DT, RF, ET, XGBoost)
 
 
@@ -610,42 +584,34 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
     x_train = np.concatenate(( dt_train, et_train, rf_train, xg_train), axis=1)
     x_test = np.concatenate(( dt_test, et_test, rf_test, xg_test), axis=1)
 
-    stk = xgb.XGBClassifier().fit(x_train, y_train)
+    stk = xgb.XGBClassifier(n_jobs = n_jobs).fit(x_train, y_train)
+    timer.lap('ensemble')
     y_predict=stk.predict(x_test)
     y_true=y_test
-    stk_score=accuracy_score(y_true,y_predict)
-    print('Accuracy of Stacking: '+ str(stk_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of Stacking: '+(str(precision)))
-    print('Recall of Stacking: '+(str(recall)))
-    print('F1-score of Stacking: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('Stacking', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics')
 
     #  #### Hyperparameter optimization (HPO) of the stacking ensemble model (XGBoost) using Bayesian optimization with tree-based Parzen estimator (BO-TPE)
     #  Based on the GitHub repo for HPO: https://github.com/LiYangHart/Hyperparameter-Optimization-of-Machine-Learning-Algorithms
 
     # 
-    from hyperopt import hp, fmin, tpe, STATUS_OK, Trials
-    from sklearn.model_selection import cross_val_score, StratifiedKFold
-    def objective(params):
+    from hyperopt import hp, STATUS_OK
+    def objective(params, x_train, x_test, y_train, y_test):
         params = {
             'n_estimators': int(params['n_estimators']), 
             'max_depth': int(params['max_depth']),
             'learning_rate':  abs(float(params['learning_rate'])),
 
         }
-        clf = xgb.XGBClassifier( **params)
+        clf = xgb.XGBClassifier( **params, n_jobs = n_jobs)
         clf.fit(x_train, y_train)
         y_pred = clf.predict(x_test)
         score = accuracy_score(y_test, y_pred)
 
-        return {'loss':-score, 'status': STATUS_OK }
+        return {'loss':-score, 'status': STATUS_OK, 'model': clf, 'y_pred': y_pred }
 
     space = {
         'n_estimators': hp.quniform('n_estimators', 10, 100, 5),
@@ -653,10 +619,10 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
         'learning_rate': hp.normal('learning_rate', 0.01, 0.9),
     }
 
-    best = fmin(fn=objective,
-                space=space,
-                algo=tpe.suggest,
-                max_evals=hpo_max_evals)
+    kept = {}
+    best = hpo.fmin(objective, space, hpo_max_evals, (x_train, x_test, y_train, y_test), hpo_parallelism, hpo_mode,
+                    family='stacking', kept=kept)
+    timer.lap('hpo_stacking')
     print("XGBoost: Hyperopt estimated optimum {}".format(best))
 
     best['n_estimators'] = int(best['n_estimators'])
@@ -665,27 +631,65 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
 
     # final stacked
     #xg = xgb.XGBClassifier(learning_rate= 0.19229249758051492, n_estimators = 30, max_depth = 36)
-    xg = xgb.XGBClassifier(**best)
-    xg.fit(x_train,y_train)
-    xg_score=xg.score(x_test,y_test)
-    y_predict=xg.predict(x_test)
+    if kept:
+        xg, y_predict = kept['model'], kept['y_pred']
+    else:
+        xg = xgb.XGBClassifier(**best, n_jobs = n_jobs)
+        xg.fit(x_train,y_train)
+        timer.lap('fit_stacking')
+        y_predict=xg.predict(x_test)
     y_true=y_test
-    print('Accuracy of XGBoost: '+ str(xg_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of XGBoost: '+(str(precision)))
-    print('Recall of XGBoost: '+(str(recall)))
-    print('F1-score of XGBoost: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('XGBoost', m)
+    xg_score=m.accuracy
+    precision,recall,fscore=m.precision,m.recall,m.f1
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics')
 
     return str(xg_score), str(precision), str(recall), str(fscore), cm
 
 
+#  ### Training schedule
+#  The four tune-and-refit branches don't depend on each other, only the stacking ensemble needs their
+#  predictions: they run as a task graph (task_graph.py), up to `workers` workers at once, and stacking
+#  starts when the last of them is done. A branch counts as many workers as its HPO search uses (each
+#  search has a process pool of its own, see hpo.py).
+#  XGBoost would start a thread per core for every fit, on top of the other branches, so its fits get
+#  an explicit n_jobs: an even share of the budget per branch and per HPO trial (the whole budget per
+#  trial for stacking, which runs alone), and those threads are counted in the cost of the task.
+#  Each step laps its own timer since they overlap; the stages are added to the run's timer afterwards,
+#  next to 'train_models', the wall time of the whole graph.
+BRANCHES = [('XGBoost', xgboost_branch), ('RF', rf_branch), ('DT', dt_branch), ('ET', et_branch)]
+
+def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals, timer=None, hpo_parallelism=None,
+                 hpo_mode=None, workers=None):
+    timer = timer or StageTimer()
+    timer.reset()
+
+    hpo_workers = hpo.workers(hpo.PARALLELISM if hpo_parallelism is None else hpo_parallelism)
+    budget = max(1, int(workers or task_graph.WORKERS))
+    xgb_threads = max(1, budget // (len(BRANCHES) * hpo_workers))
+    stacking_threads = max(1, budget // hpo_workers)
+    timers = {}
+    graph = task_graph.TaskGraph()
+    for name, branch in BRANCHES:
+        timers[name] = StageTimer()
+        kwargs = {'n_jobs': xgb_threads} if branch is xgboost_branch else {}
+        graph.add(name, branch, X_train, X_test, y_train, y_test, max_features, hpo_max_evals, hpo_parallelism, hpo_mode,
+                  timers[name], cost=hpo_workers * (xgb_threads if kwargs else 1), **kwargs)
+    timers['stacking'] = StageTimer()
+    graph.add('stacking', stacking, y_train, y_test, hpo_max_evals, hpo_parallelism, hpo_mode, timers['stacking'],
+              deps=['DT', 'ET', 'RF', 'XGBoost'], cost=hpo_workers * stacking_threads, n_jobs=stacking_threads)
+    results = graph.run(workers)
+    timer.lap('train_models')
+
+    for branch_timer in timers.values():
+        for stage, seconds in branch_timer.timings.items():
+            timer.add(stage, seconds)
+    return results['stacking']
+
+
 # %% [markdown]
 #  ## Anomaly-based IDS
 
@@ -694,7 +698,7 @@ def train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals):
 
 # %%
 def anomaly_based():
-    df=pd.read_csv('./Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/CICIDS2017_sample_km.csv')
+    df=dataset_cache.load('./Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/CICIDS2017_sample_km.csv')
     df.Label.value_counts()
 
     df1 = df[df['Label'] != 5]
@@ -706,8 +710,8 @@ def anomaly_based():
     df2.to_csv('./Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/CICIDS2017_sample_km_portscan.csv',index=0)
 
     #  ### Read the generated datasets for unknown attack detection
-    df1 = pd.read_csv('./Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/CICIDS2017_sample_km_without_portscan.csv')
-    df2 = pd.read_csv('./Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/CICIDS2017_sample_km_portscan.csv')
+    df1 = dataset_cache.load('./Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/CICIDS2017_sample_km_without_portscan.csv')
+    df2 = dataset_cache.load('./Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/CICIDS2017_sample_km_portscan.csv')
 
     features = df1.drop(['Label'],axis=1).dtypes[df1.dtypes != 'object'].index
     df1[features] = df1[features].apply(
@@ -737,8 +741,7 @@ def anomaly_based():
     #  ### Feature engineering (IG, FCBF, and KPCA)
     #  #### Feature selection by information gain (IG)
 
-    from sklearn.feature_selection import mutual_info_classif
-    importances = mutual_info_classif(X, y)
+    importances = feature_ranking.mutual_info(X, y)
 
     # calculate the sum of importance scores
     f_list = sorted(zip(map(lambda x: round(x, 4), importances), features), reverse=True)
@@ -797,9 +800,7 @@ def anomaly_based():
     pd.Series(y_train).value_counts()
 
 
-    from imblearn.over_sampling import SMOTE
-    smote=SMOTE(n_jobs=-1,sampling_strategy={1:18225})
-    X_train, y_train = smote.fit_resample(X_train, y_train)
+    X_train, y_train = resampling.smote(X_train, y_train, {1:18225})
 
     pd.Series(y_train).value_counts()
     pd.Series(y_test).value_counts()
@@ -906,8 +907,7 @@ def anomaly_based():
     print("""Best parameters: n_clusters=%d""" % (res_gp.x[0]))
 
     #Hyperparameter optimization by BO-TPE
-    from hyperopt import hp, fmin, tpe, STATUS_OK, Trials
-    from sklearn.model_selection import cross_val_score, StratifiedKFold
+    from hyperopt import hp, fmin, tpe, STATUS_OK
     from sklearn.cluster import MiniBatchKMeans
     from sklearn import metrics
 
@@ -1102,11 +1102,46 @@ def Anomaly_IDS(X_train, X_test, y_train, y_test,n,b=100):
 #  95% of the code has been shared, and the remaining 5% is retained for future extension.
 #  Thank you for your interest and more details are in the paper.
 
-def run_model(dataset_path, train_split, max_features, hpo_max_evals):
-    X_train, X_test, y_train, y_test = preprocessing(dataset_path, train_split)
-    acc, prec, recall, f1_score, cm = train_models(X_train, X_test, y_train, y_test, max_features, hpo_max_evals)
-    end_time = time.time()
-    run_model_time = end_time - start_time
-    return (str(run_model_time), acc, prec, recall, f1_score, str(cm.tolist()))
+# A single MTH run: owns its split data and timer, so two /runMth requests can go through at once.
+class MthRun:
+
+    def __init__(self, dataset_path, train_split, max_features, hpo_max_evals, compact=False, feature_selector='fcbfk', fcbf_pieces=2,
+                 mi_estimator=None, hpo_parallelism=None, hpo_mode=None, workers=None):
+        self.dataset_path = dataset_path
+        self.train_split = train_split
+        self.max_features = max_features
+        self.hpo_max_evals = hpo_max_evals
+        self.compact = compact
+        self.feature_selector = feature_selector
+        self.fcbf_pieces = fcbf_pieces
+        self.mi_estimator = mi_estimator
+        self.hpo_parallelism = hpo_parallelism
+        self.hpo_mode = hpo_mode
+        self.workers = workers
+        if (hpo_mode or hpo.MODE) not in hpo.MODES:
+            raise ValueError('Unknown hpo_mode: ' + str(hpo_mode) + ' (tpe or halving)')
+
+        self.X_train = None
+        self.X_test = None
+        self.y_train = None
+        self.y_test = None
+        self.start_time = None
+        self.timer = StageTimer()
+
+    def run(self):
+        self.X_train, self.X_test, self.y_train, self.y_test = preprocessing(self.dataset_path, self.train_split, self.timer, self.compact,
+                                                                          self.feature_selector, self.fcbf_pieces, self.mi_estimator)
+        #time models
+        self.start_time = time.time()
+        acc, prec, recall, f1_score, cm = train_models(self.X_train, self.X_test, self.y_train, self.y_test, self.max_features, self.hpo_max_evals, self.timer,
+                                                     self.hpo_parallelism, self.hpo_mode, self.workers)
+        end_time = time.time()
+        run_model_time = end_time - self.start_time
+        return (str(run_model_time), acc, prec, recall, f1_score, str(cm.tolist()))
+
+def run_model(dataset_path, train_split, max_features, hpo_max_evals, compact=False, feature_selector='fcbfk', fcbf_pieces=2,
+              mi_estimator=None, hpo_parallelism=None, hpo_mode=None, workers=None):
+    return MthRun(dataset_path, train_split, max_features, hpo_max_evals, compact, feature_selector, fcbf_pieces, mi_estimator,
+                  hpo_parallelism, hpo_mode, workers).run()
 
 #run_model()
\ No newline at end of file
@@ -2,6 +2,7 @@ import datetime
 import sqlite3
 import mth
 import json
+import stage_timer
 
 default_params = {
     "training_allocation" : 0.8,
@@ -22,17 +23,36 @@ def run(json_req):
     path = './Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/'
     dataset_path = str(json_req["model_req"]["dataset_path"])
     dataset = path + dataset_path
+    #optional: keep features as float32 / labels as small ints during preprocessing
+    compact = json_req["model_req"].get("compact", False) in (True, 1, 'true', 'True', '1')
+    #optional: 'fcbfip' selects features with FCBF in pieces (fcbf_pieces of them) instead of FCBF#
+    feature_selector = json_req["model_req"].get("feature_selector") or 'fcbfk'
+    fcbf_pieces = int(json_req["model_req"].get("fcbf_pieces") or 2)
+    #optional: 'knn' ranks the features with sklearn's k-NN mutual information instead of the binned estimator
+    mi_estimator = json_req["model_req"].get("mi_estimator") or None
+    #optional: number of hyperopt trials evaluated at once (-1 = every core)
+    hpo_parallelism = json_req["model_req"].get("hpo_parallelism")
+    hpo_parallelism = int(hpo_parallelism) if hpo_parallelism not in (None, '') else None
+    #optional: 'halving' tunes with successive halving instead of TPE
+    hpo_mode = json_req["model_req"].get("hpo_mode") or None
+    #optional: worker budget of the training graph (IDS_WORKERS, the number of cores, by default)
+    workers = json_req["model_req"].get("workers")
+    workers = int(workers) if workers not in (None, '') else None
     #run model
-    result = mth.run_model(dataset, train_split, max_features, hpo_max_evals)
+    mth_run = mth.MthRun(dataset, train_split, max_features, hpo_max_evals, compact, feature_selector, fcbf_pieces, mi_estimator,
+                         hpo_parallelism, hpo_mode, workers)
+    result = mth_run.run()
+    stage_timings = mth_run.timer.as_dict()
     #print (result)
 
     #create json
-    result_json = parse_to_json(result)
+    result_json = parse_to_json(result, stage_timings)
     #print('results')
     #print(result_json)
 
     #store results
-    record(result, train_split, max_features, hpo_max_evals, dataset_path)
+    run_id = record(result, train_split, max_features, hpo_max_evals, dataset_path)
+    stage_timer.record(run_id, 'MTH', stage_timings)
     
     return result_json
     #return json result
@@ -62,6 +82,7 @@ def get_runs():
     print(rows)
     c.close()
     connection.close()
+    timings = stage_timer.get_all('MTH')
     #parse json
     
     rows_dict = { "rows" : [] }
@@ -70,6 +91,7 @@ def get_runs():
         row_dict = {}
         for i, key in enumerate(keys):
             row_dict[key] = r[i]
+        row_dict['stage_timings'] = timings.get(row_dict['id'], {})
         rows_dict["rows"].append(row_dict)
 
     print(rows_dict)
@@ -93,17 +115,21 @@ def record(result, train_split, max_features, hpo_max_evals, dataset_path):
     record.append(dataset_path)
 
     c.execute("INSERT INTO mth (duration, accuracy, prec, recall, f1_score, heatmap_data, train_split, max_features, hpo_max_evals, run_date, dataset_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (record))
+    #the insert trigger renumbers the row to the new RunHistory id; read it before committing
+    c.execute("SELECT MAX(run_id) FROM RunHistory")
+    run_id = c.fetchone()[0]
     connection.commit()
 
     c.close()
     connection.close()
+    return run_id
 
 #read from db function? how are we searching
 # def read():
 #     pass
 
 #parse json result
-def parse_to_json(result):
+def parse_to_json(result, stage_timings=None):
     keys = ['execution_time', 'accuracy', 'precision', 'recall', 'f1', 'heatmap']
     json_result = {"model_results": {}}
 
@@ -112,6 +138,7 @@ def parse_to_json(result):
             json_result["model_results"][key] = None
         else:
             json_result["model_results"][key] = result[idx]
+    json_result["model_results"]["stage_timings"] = stage_timings
     
     json_result = json.dumps(json_result)
     return json_result
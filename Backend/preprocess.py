@@ -0,0 +1,73 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Preprocessing shared by lccde.py, mth.py and treebased.py.
+
+# ## Compact representation
+# With compact=True the feature columns are converted to float32 right after ingest and the labels
+# to the smallest unsigned integer type that holds them (uint8 for CICIDS2017). The tree learners
+# work in float32 internally anyway, so this halves the memory of every copy made while splitting
+# and resampling without changing what the learners see.
+FEATURE_DTYPE = np.float32
+
+def compact_features(df, label='Label'):
+    features = [c for c in df.columns if c != label and df[c].dtype != object and df[c].dtype != FEATURE_DTYPE]
+    if features:
+        df[features] = df[features].astype(FEATURE_DTYPE)
+    return df
+
+def label_dtype(y):
+    y = np.asarray(y)
+    if len(y) == 0 or y.min() < 0:
+        return np.int64
+    return np.min_scalar_type(int(y.max()))
+
+#integer labels (array or Series), in the smallest type when compact and as int otherwise (what the pipelines used before)
+def labels(y, compact=False):
+    y = y.astype(int)
+    if compact:
+        return y.astype(label_dtype(y))
+    return y
+
+# ## Min-max normalization
+# One pass for the column minima/maxima, then the matrix is scaled in place. Gives the same values as
+# the old per-column (x - x.min()) / (x.max() - x.min()) followed by fillna(0):
+# - NaNs are skipped when fitting and become 0
+# - a column whose range is 0, NaN (all values missing) or inf (e.g. 'Flow Bytes/s' containing inf)
+#   would only produce NaN or 0 there, so it is set to 0 directly
+def minmax_fit(X):
+    with warnings.catch_warnings():
+        # all-NaN columns; their range ends up NaN and they are zeroed in minmax_apply
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmin(X, axis=0), np.nanmax(X, axis=0)
+
+def minmax_apply(X, col_min, col_max):
+    col_min = np.asarray(col_min, dtype=X.dtype)
+    col_range = np.asarray(col_max, dtype=X.dtype) - col_min
+    degenerate = ~np.isfinite(col_range) | (col_range == 0)
+    col_range[degenerate] = 1
+
+    with np.errstate(invalid='ignore', over='ignore'):
+        np.subtract(X, col_min, out=X)
+        np.divide(X, col_range, out=X)
+    X[:, degenerate] = 0
+    np.copyto(X, 0, where=np.isnan(X))
+    return X
+
+#normalize the given columns of a frame; returns the new frame and the fitted minima/maxima (so new data can be scaled the same way)
+def normalize(df, columns):
+    dtype = FEATURE_DTYPE if all(df[c].dtype == FEATURE_DTYPE for c in columns) else np.float64
+    X = df[columns].to_numpy(dtype=dtype, copy=True)
+    col_min, col_max = minmax_fit(X)
+    minmax_apply(X, col_min, col_max)
+
+    # copy=False: the frame is a view of X, the remaining columns (the label) are added next to it
+    out = pd.DataFrame(X, columns=columns, index=df.index, copy=False)
+    for c in df.columns:
+        if c not in out.columns:
+            out[c] = df[c]
+    if list(out.columns) != list(df.columns):
+        out = out[list(df.columns)]
+    return out, col_min, col_max
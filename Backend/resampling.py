@@ -0,0 +1,138 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import NearestNeighbors
+
+import dataset_cache
+
+try:
+    import pynndescent
+except ImportError:
+    pynndescent = None
+
+# SMOTE oversampling for the model files, in place of imblearn's SMOTE(n_jobs=-1, ...).
+# Same algorithm: for every class in sampling_strategy ({class: target count}), target - count new rows
+# are placed at a random point between a random row of the class and one of its k nearest neighbours.
+# What's different:
+# - the k-NN graph of each class is cached, keyed by a hash of the class rows and k. The same dataset,
+#   split and feature subset always gives the same rows, so repeated runs (and treebased's second
+#   SMOTE on the same split) look the graph up instead of searching again. Graphs are kept in memory
+#   (the last MEMORY_GRAPHS) and under NEIGHBOR_DIR, which is capped at IDS_NEIGHBOR_CACHE_MB (default 512)
+#   like the stage cache: the least recently used graphs are deleted first
+# - classes with at least ANN_MIN_ROWS rows use an approximate graph from pynndescent when it is
+#   installed (IDS_SMOTE_BACKEND=exact|ann|auto picks the backend, auto is the default)
+# - the new rows are generated in one vectorized step per class
+NEIGHBOR_DIR = os.path.join(dataset_cache.CACHE_DIR, 'neighbors')
+BACKEND = os.environ.get('IDS_SMOTE_BACKEND', 'auto')
+K_NEIGHBORS = 5
+ANN_MIN_ROWS = 50000
+MEMORY_GRAPHS = 32
+MAX_BYTES = int(float(os.environ.get('IDS_NEIGHBOR_CACHE_MB', '512')) * 2**20)
+
+_graphs = OrderedDict()
+_graph_lock = threading.Lock()
+
+def pick_backend(n_rows, backend=None):
+    backend = backend or BACKEND
+    if backend == 'auto':
+        return 'ann' if pynndescent is not None and n_rows >= ANN_MIN_ROWS else 'exact'
+    if backend == 'ann' and pynndescent is None:
+        raise ImportError('The ann SMOTE backend needs pynndescent (pip install pynndescent)')
+    if backend not in ('exact', 'ann'):
+        raise ValueError('Unknown SMOTE backend: ' + str(backend))
+    return backend
+
+def graph_key(X_class, k, backend):
+    X_class = np.ascontiguousarray(X_class)
+    h = hashlib.sha256()
+    h.update(repr((X_class.shape, X_class.dtype.str, k, backend)).encode('utf-8'))
+    h.update(X_class.data)
+    return h.hexdigest()
+
+#indices of the k nearest neighbours of every row (the row itself excluded)
+def exact_neighbors(X_class, k):
+    nn = NearestNeighbors(n_neighbors=k + 1, n_jobs=-1).fit(X_class)
+    return nn.kneighbors(X_class, return_distance=False)[:, 1:]
+
+def approximate_neighbors(X_class, k):
+    index = pynndescent.NNDescent(X_class, n_neighbors=k + 1, n_jobs=-1)
+    indices, _ = index.neighbor_graph
+    return indices[:, 1:]
+
+def neighbors(X_class, k=K_NEIGHBORS, backend=None):
+    backend = pick_backend(len(X_class), backend)
+    key = graph_key(X_class, k, backend)
+    with _graph_lock:
+        if key in _graphs:
+            _graphs.move_to_end(key)
+            return _graphs[key]
+
+    path = os.path.join(NEIGHBOR_DIR, key + '.npy')
+    try:
+        nns = np.load(path)
+        os.utime(path)
+    except (OSError, ValueError):
+        nns = exact_neighbors(X_class, k) if backend == 'exact' else approximate_neighbors(X_class, k)
+        nns = nns.astype(np.int32)
+        os.makedirs(NEIGHBOR_DIR, exist_ok=True)
+        tmp = path + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, nns)
+        os.replace(tmp, path)
+        # stage_cache imports this module, so it is imported here rather than at the top
+        import stage_cache
+        stage_cache.evict(MAX_BYTES, NEIGHBOR_DIR, '*.npy')
+
+    with _graph_lock:
+        _graphs[key] = nns
+        while len(_graphs) > MEMORY_GRAPHS:
+            _graphs.popitem(last=False)
+    return nns
+
+#n_samples new rows, each a random step from a random row towards one of its neighbours
+def synthesize(X_class, nns, n_samples, rng):
+    k = nns.shape[1]
+    rows, cols = np.divmod(rng.integers(0, len(X_class) * k, n_samples), k)
+    steps = rng.random(n_samples)[:, np.newaxis]
+    base = X_class[rows]
+    X_new = base + steps * (X_class[nns[rows, cols]] - base)
+    return X_new.astype(X_class.dtype, copy=False)
+
+#oversample X, y (array or DataFrame/Series); the original rows come first, then the new rows of each class
+def smote(X, y, sampling_strategy, k_neighbors=K_NEIGHBORS, backend=None, random_state=None):
+    columns = X.columns if isinstance(X, pd.DataFrame) else None
+    X_arr = np.asarray(X)
+    y_arr = np.asarray(y)
+    rng = np.random.default_rng(random_state)
+
+    X_parts = [X_arr]
+    y_parts = [y_arr]
+    for label, target in sorted(sampling_strategy.items()):
+        idx = np.flatnonzero(y_arr == label)
+        n_samples = int(target) - len(idx)
+        if len(idx) == 0:
+            raise ValueError('SMOTE target given for class ' + str(label) + ', which is not in the training set')
+        if n_samples < 0:
+            raise ValueError('SMOTE target ' + str(target) + ' for class ' + str(label) + ' is below its ' +
+                             str(len(idx)) + ' samples')
+        if n_samples == 0:
+            continue
+        if len(idx) <= k_neighbors:
+            raise ValueError('Class ' + str(label) + ' has ' + str(len(idx)) + ' samples, SMOTE needs more than ' +
+                             str(k_neighbors))
+        X_class = X_arr[idx]
+        nns = neighbors(X_class, k_neighbors, backend)
+        X_parts.append(synthesize(X_class, nns, n_samples, rng))
+        y_parts.append(np.full(n_samples, label, dtype=y_arr.dtype))
+
+    X_res = np.concatenate(X_parts)
+    y_res = np.concatenate(y_parts)
+    if columns is not None:
+        X_res = pd.DataFrame(X_res, columns=columns)
+    if isinstance(y, pd.Series):
+        y_res = pd.Series(y_res, name=y.name)
+    return X_res, y_res
@@ -0,0 +1,179 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+
+import joblib
+from sklearn.preprocessing import LabelEncoder
+from sklearn.model_selection import train_test_split
+
+import dataset_cache
+import preprocess
+import resampling
+
+# Memoized preprocessing stages. Each stage's key is a hash of its name, the keys of the stages it
+# reads from (or the dataset fingerprint) and its parameters, and its output is stored under STAGE_DIR.
+# Because the key of a stage includes the keys of its inputs, changing a parameter only recomputes the
+# stages from that point on: a /runMth with a new hpo_max_evals loads the SMOTE output directly, a new
+# train_split reuses the normalized frame, and /runLccde and /runTree on the same dataset share their
+# split and SMOTE output.
+# The directory is capped at IDS_STAGE_CACHE_MB (default 2048); the least recently used outputs are
+# deleted first. IDS_STAGE_CACHE=0 turns the cache off.
+# Stages that are random (SMOTE, mutual information) are computed once per key and then reused, so
+# runs on the same inputs see the same samples.
+STAGE_DIR = './Backend/stage_cache/'
+ENABLED = os.environ.get('IDS_STAGE_CACHE', '1') == '1'
+MAX_BYTES = int(float(os.environ.get('IDS_STAGE_CACHE_MB', '2048')) * 2**20)
+
+_evict_lock = threading.Lock()
+
+
+#a stage output; it is loaded or computed when .value is first read, so stages whose downstream
+#outputs are already stored are never loaded at all
+class Result:
+
+    def __init__(self, key, compute, persist=True, timer=None, lap=None):
+        self.key = key
+        self.compute = compute
+        self.persist = persist and ENABLED
+        self.timer = timer
+        self.lap = lap
+        self.hit = False
+        self._value = None
+        self._done = False
+
+    @property
+    def value(self):
+        if not self._done:
+            self._value = self.load()
+            self._done = True
+        return self._value
+
+    #the stage timer gets a lap when the output is computed (upstream stages computed on the way lap
+    #first), and a '<lap>_cached' lap when it is read from STAGE_DIR
+    def record(self, suffix=''):
+        if self.timer is not None and self.lap is not None:
+            self.timer.lap(self.lap + suffix)
+
+    def load(self):
+        if not self.persist:
+            value = self.compute()
+            self.record()
+            return value
+
+        path = stage_path(self.key)
+        try:
+            value = joblib.load(path)
+            os.utime(path)
+            self.hit = True
+            self.record('_cached')
+            return value
+        except (OSError, EOFError, ValueError):
+            pass
+
+        value = self.compute()
+        self.record()
+        os.makedirs(STAGE_DIR, exist_ok=True)
+        tmp = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+        joblib.dump(value, tmp)
+        os.replace(tmp, path)
+        evict()
+        return value
+
+
+def stage_key(name, inputs, params):
+    inputs = [i.key if isinstance(i, Result) else i for i in inputs]
+    payload = json.dumps({'stage': name, 'inputs': inputs, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def stage_path(key):
+    return os.path.join(STAGE_DIR, key + '.joblib')
+
+#the stage output for these inputs (Results of other stages, or e.g. a dataset fingerprint) and parameters
+#persist=False only derives the key (for stages that are cheaper to redo than to store)
+def run(name, inputs, params, compute, persist=True, timer=None, lap=None):
+    return Result(stage_key(name, inputs, params), compute, persist, timer, lap)
+
+#delete the least recently used outputs until the directory is below max_bytes (also used for other
+#file caches, e.g. resampling.py's neighbour graphs, with their own directory and file pattern)
+def evict(max_bytes=None, directory=STAGE_DIR, pattern='*.joblib'):
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    with _evict_lock:
+        entries = []
+        for path in glob.glob(os.path.join(directory, pattern)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+# ## Stages shared by lccde.py, mth.py and treebased.py
+
+#the dataset as the models see it: (df, prep) with normalized features and integer labels; prep records
+#what was done to the raw columns (see LCCDEScorer). Only stored when it normalizes, loading the
+#dataset and encoding the labels is faster than reading a stored copy
+def prepared(ds, compact=False, timer=None):
+    def compute():
+        df = dataset_cache.load(ds.path)
+        if compact:
+            df = preprocess.compact_features(df, ds.label)
+        if timer is not None:
+            timer.lap('ingest')
+
+        prep = {'columns': list(df.drop([ds.label],axis=1).columns), 'min': None, 'max': None, 'classes': ds.classes}
+        if ds.normalize:
+            numeric_features = list(df.dtypes[df.dtypes != 'object'].index)
+            # Min-max normalization (empty values become 0); the fitted statistics are kept for LCCDEScorer
+            df, col_min, col_max = preprocess.normalize(df, numeric_features)
+            prep['min'] = col_min.astype(float)
+            prep['max'] = col_max.astype(float)
+        elif ds.scaling() is not None:
+            # normalized when the dataset was prepared; the scorer needs the same statistics
+            prep['min'], prep['max'] = ds.scaling()
+
+        if ds.encode_labels:
+            labelencoder = LabelEncoder()
+            df[ds.label] = labelencoder.fit_transform(df[ds.label])
+            prep['classes'] = labelencoder.classes_.tolist()
+        return df, prep
+
+    params = {'label': ds.label, 'classes': ds.classes, 'normalize': ds.normalize,
+              'encode_labels': ds.encode_labels, 'compact': compact}
+    return run('prepare', [ds.fingerprint()], params, compute, persist=ds.normalize, timer=timer, lap='normalize')
+
+#prep of a prepared dataset on its own, so it can be read without loading the frame
+def preparation(prepared_result, timer=None):
+    return run('preparation', [prepared_result], {}, lambda: prepared_result.value[1], timer=timer, lap='normalize')
+
+#[X_train, X_test, y_train, y_test] of the prepared frame (all features, or the given columns in that order)
+def split(prepared_result, ds, train_size=0.8, stratify=True, columns=None, compact=False, timer=None):
+    def compute():
+        df = prepared_result.value[0]
+        X = df[list(columns)] if columns is not None else df.drop([ds.label],axis=1)
+        y = preprocess.labels(df[ds.label], compact)
+        return train_test_split(X, y, train_size = train_size, test_size = round(1 - train_size, 10), random_state = 0,
+                                stratify = y if stratify else None)
+
+    params = {'train_size': train_size, 'stratify': stratify, 'columns': columns, 'compact': compact, 'random_state': 0}
+    return run('split', [prepared_result], params, compute, timer=timer, lap='split')
+
+#(X_train, y_train) of the split after SMOTE with the given targets
+def oversampled(split_result, targets, timer=None):
+    def compute():
+        X_train, _, y_train, _ = split_result.value
+        if not targets:
+            return X_train, y_train
+        return resampling.smote(X_train, y_train, targets)
+
+    return run('smote', [split_result], {'targets': sorted(targets.items()) if targets else None}, compute,
+               persist=bool(targets), timer=timer, lap='resample' if targets else None)
@@ -0,0 +1,71 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# Wall-clock time per pipeline stage (ingest, normalize, feature selection, resample, each learner fit,
+# HPO, ensemble scoring, metrics). Stages that run more than once in a run are added up.
+class StageTimer:
+
+    def __init__(self):
+        self.timings = {}
+        self.created = time.perf_counter()
+        self.last = self.created
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    #restart the lap clock without recording anything (e.g. after work that shouldn't be counted)
+    def reset(self):
+        self.last = time.perf_counter()
+
+    #record the time since the previous lap (or reset) under name
+    def lap(self, name):
+        now = time.perf_counter()
+        self.add(name, now - self.last)
+        self.last = now
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+            self.last = time.perf_counter()
+
+    def as_dict(self):
+        timings = dict(self.timings)
+        timings['total'] = time.perf_counter() - self.created
+        return timings
+
+
+#store the stage timings of a run next to its row (run_id is the id from RunHistory)
+def record(run_id, model, timings):
+    connection = sqlite3.connect('test_DB.db')
+    c = connection.cursor()
+
+    #databases created before the RunStages table existed
+    c.execute("CREATE TABLE IF NOT EXISTS RunStages (id INTEGER PRIMARY KEY AUTOINCREMENT, run_id INTEGER, model VARCHAR, stage VARCHAR, seconds FLOAT)")
+    c.executemany("INSERT INTO RunStages (run_id, model, stage, seconds) VALUES (?, ?, ?, ?)",
+                  [(run_id, model, stage, seconds) for stage, seconds in timings.items()])
+    connection.commit()
+
+    c.close()
+    connection.close()
+
+#stage timings of every stored run of a model: {run_id: {stage: seconds}}
+def get_all(model):
+    connection = sqlite3.connect('test_DB.db')
+    c = connection.cursor()
+
+    c.execute("CREATE TABLE IF NOT EXISTS RunStages (id INTEGER PRIMARY KEY AUTOINCREMENT, run_id INTEGER, model VARCHAR, stage VARCHAR, seconds FLOAT)")
+    c.execute("SELECT run_id, stage, seconds FROM RunStages WHERE model = ? ORDER BY id", (model,))
+    rows = c.fetchall()
+
+    c.close()
+    connection.close()
+
+    timings = {}
+    for run_id, stage, seconds in rows:
+        timings.setdefault(run_id, {})[stage] = seconds
+    return timings
@@ -0,0 +1,70 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# A small dependency graph of pipeline steps, run on a thread pool within a worker budget.
+# A task starts as soon as the tasks it depends on have finished and enough of the budget is free; it
+# gets their outputs as extra positional arguments, in the order of its deps. The cost of a task is the
+# number of workers it keeps busy (e.g. an HPO search that evaluates four trials at a time costs 4), so
+# the graph never runs more than the budget at once. A task that costs more than the whole budget runs
+# alone. Tasks are started in the order they were added when several are ready.
+# The tasks run in threads: the learners (sklearn trees, XGBoost) release the GIL while fitting, and
+# process pools started by a task (hpo.py) work the same as from the main thread.
+# IDS_WORKERS sets the default budget (the number of cores).
+WORKERS = int(os.environ.get('IDS_WORKERS', os.cpu_count() or 1))
+
+class Task:
+
+    def __init__(self, name, fn, args, kwargs, deps, cost):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.deps = list(deps)
+        self.cost = cost
+
+class TaskGraph:
+
+    def __init__(self):
+        self.tasks = {}
+
+    #dependencies must already be in the graph, so the graph can't have cycles
+    def add(self, name, fn, *args, deps=(), cost=1, **kwargs):
+        if name in self.tasks:
+            raise ValueError('Task ' + str(name) + ' is already in the graph')
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError('Task ' + str(name) + ' depends on unknown task ' + str(dep))
+        self.tasks[name] = Task(name, fn, args, kwargs, deps, max(1, int(cost)))
+        return self
+
+    #run every task; returns {name: output}. The first task that raises stops the graph (running tasks
+    #are finished, nothing new is started) and its exception is raised here
+    def run(self, workers=None):
+        budget = max(1, int(workers or WORKERS))
+        pending = list(self.tasks.values())
+        results = {}
+        running = {}
+        used = 0
+        with ThreadPoolExecutor(max_workers=min(budget, max(1, len(pending)))) as pool:
+            while pending or running:
+                for task in list(pending):
+                    if any(dep not in results for dep in task.deps):
+                        continue
+                    cost = min(task.cost, budget)
+                    if running and used + cost > budget:
+                        continue
+                    pending.remove(task)
+                    used += cost
+                    future = pool.submit(task.fn, *task.args, *[results[dep] for dep in task.deps], **task.kwargs)
+                    running[future] = (task, cost)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task, cost = running.pop(future)
+                    used -= cost
+                    error = future.exception()
+                    if error is not None:
+                        wait(running)
+                        raise error
+                    results[task.name] = future.result()
+        return results
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lccde
+
+COLUMNS = ['Feat 0', 'Feat 1']
+
+def scorer(col_min=(0.0, 0.0), col_max=(10.0, 4.0)):
+    prep = {'columns': COLUMNS, 'min': col_min, 'max': col_max, 'classes': None}
+    return lccde.LCCDEScorer(None, None, None, [], prep)
+
+def test_transform_scales_dict_rows():
+    X = scorer().transform([{'Feat 0': 5, 'Feat 1': 1, 'Label': 0}, {'Feat 0': 10, 'Feat 1': 4}])
+    np.testing.assert_allclose(X, [[0.5, 0.25], [1.0, 1.0]])
+
+def test_transform_rejects_partial_batch():
+    with pytest.raises(ValueError, match='Row 1 is missing feature columns: Feat 0'):
+        scorer().transform([{'Feat 0': 5, 'Feat 1': 1}, {'Feat 1': 2}])
+
+def test_transform_rejects_empty_batch():
+    with pytest.raises(ValueError):
+        scorer().transform([])
+
+def test_transform_needs_normalized_rows_without_statistics():
+    unscaled = scorer(None, None)
+    with pytest.raises(ValueError):
+        unscaled.transform([[0.5, 0.5]])
+    np.testing.assert_allclose(unscaled.transform([[0.5, 0.5]], normalized=True), [[0.5, 0.5]])
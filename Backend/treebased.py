@@ -15,16 +15,16 @@ warnings.filterwarnings("ignore")
 # %%
 import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-from sklearn.preprocessing import LabelEncoder 
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report,confusion_matrix,accuracy_score,precision_recall_fscore_support
 from sklearn.metrics import f1_score
 from sklearn.ensemble import RandomForestClassifier,ExtraTreesClassifier
 from sklearn.tree import DecisionTreeClassifier
 import xgboost as xgb
 from xgboost import plot_importance
+from stage_timer import StageTimer
+import heatmap
+import datasets
+import metrics
+import stage_cache
 
 # %% [markdown]
 # ## Read the sampled CICIDS2017 dataset
@@ -70,177 +70,83 @@ from xgboost import plot_importance
 # df_s.to_csv('./data/CICIDS2017_sample.csv',index=0)
 
 # %% [markdown]
-# ### Preprocessing (normalization and padding values)
-
-def preprocessing(data_path):
-    global df, y
-    df = pd.read_csv(data_path)
-
-    # %%
-    # Min-max normalization
-    numeric_features = df.dtypes[df.dtypes != 'object'].index
-    df[numeric_features] = df[numeric_features].apply(
-        lambda x: (x - x.min()) / (x.max()-x.min()))
-    # Fill empty values by 0
-    df = df.fillna(0)
-
-    # %% [markdown]
-    # ### split train set and test set
-
-    # %%
-    labelencoder = LabelEncoder()
-    df.iloc[:, -1] = labelencoder.fit_transform(df.iloc[:, -1])
-    X = df.drop(['Label'],axis=1).values 
-    y = df.iloc[:, -1].values.reshape(-1,1)
-    y=np.ravel(y)
-    X_train, X_test, y_train, y_test = train_test_split(X,y, train_size = 0.8, test_size = 0.2, random_state = 0,stratify = y)
-
-    # %%
-    X_train.shape
-
-    # %%
-    pd.Series(y_train).value_counts()
-
-    # %% [markdown]
-    # ### Oversampling by SMOTE
-
-    # %%
-    from imblearn.over_sampling import SMOTE
-    smote=SMOTE(n_jobs=-1,sampling_strategy={4:1500}) # Create 1500 samples for the minority class "4"
-
-    # %%
-    y_train = y_train.astype(int)
-    y_train = np.array(y_train)
-    y_test = y_test.astype(int)
-    y_test = np.array(y_test)
-    X_train, y_train = smote.fit_resample(X_train, y_train)
-
-    # %%
-    pd.Series(y_train).value_counts()
-
-    return X_train, X_test, y_train, y_test
-
-# %% [markdown]
-# ## Machine learning model training
-
-def train_base(X_train, X_test, y_train, y_test, xgb_params, dtree_params, rtree_params, etree_params):
-
-    #time models
-    global start_time
-    start_time = time.time()
-
-    # ### Training four base learners: decision tree, random forest, extra trees, XGBoost
+def train_after_feature_select(X_train, X_test, y_train, y_test, timer=None):
+    # ## Machine learning model training after feature selection
+    timer = timer or StageTimer()
+    timer.reset()
 
     # %%
-    # Decision tree training and prediction
-    global dt
-    global rf
-    global et
-    global xg
-
-    dt = DecisionTreeClassifier(**dtree_params)
+    dt = DecisionTreeClassifier(random_state = 0)
     dt.fit(X_train,y_train) 
-    dt_score=dt.score(X_test,y_test)
+    timer.lap('fit_DT_fs')
     y_predict=dt.predict(X_test)
     y_true=y_test
-    print('Accuracy of DT: '+ str(dt_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of DT: '+(str(precision)))
-    print('Recall of DT: '+(str(recall)))
-    print('F1-score of DT: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
-    dt_f1 = fscore
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('DT', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics_fs')
 
     # %%
     dt_train=dt.predict(X_train)
     dt_test=dt.predict(X_test)
+    timer.lap('ensemble_fs')
 
     # %%
-    # Random Forest training and prediction
-    rf = RandomForestClassifier(**rtree_params)
-    rf.fit(X_train,y_train) 
-    rf_score=rf.score(X_test,y_test)
+    rf = RandomForestClassifier(random_state = 0)
+    rf.fit(X_train,y_train) # modelin veri üzerinde öğrenmesi fit fonksiyonuyla yapılıyor
+    timer.lap('fit_RF_fs')
     y_predict=rf.predict(X_test)
     y_true=y_test
-    print('Accuracy of RF: '+ str(rf_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of RF: '+(str(precision)))
-    print('Recall of RF: '+(str(recall)))
-    print('F1-score of RF: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
-    rt_f1 = fscore
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('RF', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics_fs')
 
     # %%
     rf_train=rf.predict(X_train)
     rf_test=rf.predict(X_test)
+    timer.lap('ensemble_fs')
 
     # %%
-    # Extra trees training and prediction
-    et = ExtraTreesClassifier(**etree_params)
+    et = ExtraTreesClassifier(random_state = 0)
     et.fit(X_train,y_train) 
-    et_score=et.score(X_test,y_test)
+    timer.lap('fit_ET_fs')
     y_predict=et.predict(X_test)
     y_true=y_test
-    print('Accuracy of ET: '+ str(et_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of ET: '+(str(precision)))
-    print('Recall of ET: '+(str(recall)))
-    print('F1-score of ET: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
-    et_f1 = fscore
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('ET', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics_fs')
 
     # %%
     et_train=et.predict(X_train)
     et_test=et.predict(X_test)
+    timer.lap('ensemble_fs')
 
     # %%
-    # XGboost training and prediction
-    xg = xgb.XGBClassifier(**xgb_params)
+    xg = xgb.XGBClassifier(n_estimators = 10)
     xg.fit(X_train,y_train)
-    xg_score=xg.score(X_test,y_test)
+    timer.lap('fit_XGBoost_fs')
     y_predict=xg.predict(X_test)
     y_true=y_test
-    print('Accuracy of XGBoost: '+ str(xg_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of XGBoost: '+(str(precision)))
-    print('Recall of XGBoost: '+(str(recall)))
-    print('F1-score of XGBoost: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
-    xgb_f1 = fscore
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('XGBoost', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics_fs')
 
     # %%
     xg_train=xg.predict(X_train)
     xg_test=xg.predict(X_test)
+    timer.lap('ensemble_fs')
 
     # %% [markdown]
-    # ### Stacking model construction (ensemble for 4 base learners)
+    # ### Stacking model construction
 
     # %%
-    # Use the outputs of 4 base models to construct a new ensemble model
     base_predictions_train = pd.DataFrame( {
         'DecisionTree': dt_train.ravel(),
             'RandomForest': rf_train.ravel(),
@@ -265,246 +171,256 @@ def train_base(X_train, X_test, y_train, y_test, xgb_params, dtree_params, rtree
 
     # %%
     stk = xgb.XGBClassifier().fit(x_train, y_train)
-
-    # %%
+    timer.lap('ensemble_fs')
     y_predict=stk.predict(x_test)
     y_true=y_test
-    stk_score=accuracy_score(y_true,y_predict)
-    print('Accuracy of Stacking: '+ str(stk_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of Stacking: '+(str(precision)))
-    print('Recall of Stacking: '+(str(recall)))
-    print('F1-score of Stacking: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
-    return dt_f1, rt_f1, et_f1, xgb_f1
+    m=metrics.evaluate(y_true,y_predict)
+    metrics.print_summary('Stacking', m)
+    cm=m.cm
+    heatmap.plot_confusion_matrix(cm)
+    timer.lap('metrics_fs')
+    return str(m.accuracy), m.precision, m.recall, m.f1, cm
 
 # %% [markdown]
-def feature_selection():
-    # ## Feature Selection
+# ## Tree-based IDS run
+# Keeps the loaded frame, the four base learners and the timer of one run on the instance
+# (feature_selection reads the fitted learners back from it).
+
+class TreeBasedRun:
+
+    def __init__(self, data_path, xgb_params, dtree_params, rtree_params, etree_params, compact=False):
+        self.data_path = data_path
+        self.dataset = datasets.get(data_path)
+        self.compact = compact
+        self.xgb_params = xgb_params
+        self.dtree_params = dtree_params
+        self.rtree_params = rtree_params
+        self.etree_params = etree_params
+
+        self.prepared = None
+        self.dt = None
+        self.rf = None
+        self.et = None
+        self.xg = None
+        self.start_time = None
+        self.timer = StageTimer()
 
     # %% [markdown]
-    # ### Feature importance
-
-    # %%
-    # Save the feature importance lists generated by four tree-based algorithms
-    dt_feature = dt.feature_importances_
-    rf_feature = rf.feature_importances_
-    et_feature = et.feature_importances_
-    xgb_feature = xg.feature_importances_
-
-    # %%
-    # calculate the average importance value of each feature
-    avg_feature = (dt_feature + rf_feature + et_feature + xgb_feature)/4
-
-    # %%
-    feature=(df.drop(['Label'],axis=1)).columns.values
-    print ("Features sorted by their score:")
-    print (sorted(zip(map(lambda x: round(x, 4), avg_feature), feature), reverse=True))
-
-    # %%
-    f_list = sorted(zip(map(lambda x: round(x, 4), avg_feature), feature), reverse=True)
-
-    # %%
-    len(f_list)
-
-    # %%
-    # Select the important features from top-importance to bottom-importance until the accumulated importance reaches 0.9 (out of 1)
-    Sum = 0
-    fs = []
-    for i in range(0, len(f_list)):
-        Sum = Sum + f_list[i][0]
-        fs.append(f_list[i][1])
-        if Sum>=0.9:
-            break        
-
-    # %%
-    X_fs = df[fs].values
-
-    # %%
-    X_train, X_test, y_train, y_test = train_test_split(X_fs,y, train_size = 0.8, test_size = 0.2, random_state = 0,stratify = y)
-
-    # %%
-    X_train.shape
+    # ### Preprocessing (normalization and padding values)
 
-    # %%
-    pd.Series(y_train).value_counts()
+    def preprocessing(self):
+        self.timer.reset()
+        # %%
+        # Min-max normalization (empty values become 0) and label encoding, as far as the dataset needs them.
+        # The stages are memoized in stage_cache.py; LCCDE uses the same split and SMOTE output
+        self.prepared = stage_cache.prepared(self.dataset, self.compact, self.timer)
+        return self.split_and_oversample()
 
     # %% [markdown]
-    # ### Oversampling by SMOTE
-
-    # %%
-    from imblearn.over_sampling import SMOTE
-    smote=SMOTE(n_jobs=-1,sampling_strategy={4:1500})
-
-    # %%
-    y_train = y_train.astype(int)
-    y_train = np.array(y_train)
-    y_test = y_test.astype(int)
-    y_test = np.array(y_test)
-    X_train, y_train = smote.fit_resample(X_train, y_train)
-
-    # %%
-    pd.Series(y_train).value_counts()
-    return X_train, X_test, y_train, y_test
-
-# %% [markdown]
-def train_after_feature_select(X_train, X_test, y_train, y_test):
-    # ## Machine learning model training after feature selection
-
-    # %%
-    dt = DecisionTreeClassifier(random_state = 0)
-    dt.fit(X_train,y_train) 
-    dt_score=dt.score(X_test,y_test)
-    y_predict=dt.predict(X_test)
-    y_true=y_test
-    print('Accuracy of DT: '+ str(dt_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of DT: '+(str(precision)))
-    print('Recall of DT: '+(str(recall)))
-    print('F1-score of DT: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
-
-    # %%
-    dt_train=dt.predict(X_train)
-    dt_test=dt.predict(X_test)
-
-    # %%
-    rf = RandomForestClassifier(random_state = 0)
-    rf.fit(X_train,y_train) # modelin veri üzerinde öğrenmesi fit fonksiyonuyla yapılıyor
-    rf_score=rf.score(X_test,y_test)
-    y_predict=rf.predict(X_test)
-    y_true=y_test
-    print('Accuracy of RF: '+ str(rf_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of RF: '+(str(precision)))
-    print('Recall of RF: '+(str(recall)))
-    print('F1-score of RF: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
-
-    # %%
-    rf_train=rf.predict(X_train)
-    rf_test=rf.predict(X_test)
+    # ### split train set and test set, oversampling by SMOTE (with the dataset's targets, e.g. {4:1500})
 
-    # %%
-    et = ExtraTreesClassifier(random_state = 0)
-    et.fit(X_train,y_train) 
-    et_score=et.score(X_test,y_test)
-    y_predict=et.predict(X_test)
-    y_true=y_test
-    print('Accuracy of ET: '+ str(et_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of ET: '+(str(precision)))
-    print('Recall of ET: '+(str(recall)))
-    print('F1-score of ET: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+    # all features, or the selected columns
+    def split_and_oversample(self, columns=None):
+        split = stage_cache.split(self.prepared, self.dataset, 0.8, self.dataset.stratify, columns=columns,
+                                  compact=self.compact, timer=self.timer)
+        X_train, y_train = stage_cache.oversampled(split, self.dataset.smote, self.timer).value
+        _, X_test, _, y_test = split.value
 
-    # %%
-    et_train=et.predict(X_train)
-    et_test=et.predict(X_test)
+        # %%
+        pd.Series(y_train).value_counts()
 
-    # %%
-    xg = xgb.XGBClassifier(n_estimators = 10)
-    xg.fit(X_train,y_train)
-    xg_score=xg.score(X_test,y_test)
-    y_predict=xg.predict(X_test)
-    y_true=y_test
-    print('Accuracy of XGBoost: '+ str(xg_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of XGBoost: '+(str(precision)))
-    print('Recall of XGBoost: '+(str(recall)))
-    print('F1-score of XGBoost: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
+        return np.asarray(X_train), np.asarray(X_test), np.asarray(y_train), np.asarray(y_test)
 
-    # %%
-    xg_train=xg.predict(X_train)
-    xg_test=xg.predict(X_test)
 
     # %% [markdown]
-    # ### Stacking model construction
-
-    # %%
-    base_predictions_train = pd.DataFrame( {
-        'DecisionTree': dt_train.ravel(),
-            'RandomForest': rf_train.ravel(),
-        'ExtraTrees': et_train.ravel(),
-        'XgBoost': xg_train.ravel(),
-        })
-    base_predictions_train.head(5)
-
-    # %%
-    dt_train=dt_train.reshape(-1, 1)
-    et_train=et_train.reshape(-1, 1)
-    rf_train=rf_train.reshape(-1, 1)
-    xg_train=xg_train.reshape(-1, 1)
-    dt_test=dt_test.reshape(-1, 1)
-    et_test=et_test.reshape(-1, 1)
-    rf_test=rf_test.reshape(-1, 1)
-    xg_test=xg_test.reshape(-1, 1)
+    # ## Machine learning model training
+
+    def train_base(self, X_train, X_test, y_train, y_test):
+
+        #time models
+        self.start_time = time.time()
+        self.timer.reset()
+
+        # ### Training four base learners: decision tree, random forest, extra trees, XGBoost
+
+        # %%
+        # Decision tree training and prediction
+        dt = DecisionTreeClassifier(**self.dtree_params)
+        dt.fit(X_train,y_train) 
+        self.timer.lap('fit_DT')
+        y_predict=dt.predict(X_test)
+        y_true=y_test
+        m=metrics.evaluate(y_true,y_predict)
+        metrics.print_summary('DT', m)
+        cm=m.cm
+        heatmap.plot_confusion_matrix(cm)
+        self.timer.lap('metrics')
+        dt_f1 = m.f1
+
+        # %%
+        dt_train=dt.predict(X_train)
+        dt_test=dt.predict(X_test)
+        self.timer.lap('ensemble')
+
+        # %%
+        # Random Forest training and prediction
+        rf = RandomForestClassifier(**self.rtree_params)
+        rf.fit(X_train,y_train) 
+        self.timer.lap('fit_RF')
+        y_predict=rf.predict(X_test)
+        y_true=y_test
+        m=metrics.evaluate(y_true,y_predict)
+        metrics.print_summary('RF', m)
+        cm=m.cm
+        heatmap.plot_confusion_matrix(cm)
+        self.timer.lap('metrics')
+        rt_f1 = m.f1
+
+        # %%
+        rf_train=rf.predict(X_train)
+        rf_test=rf.predict(X_test)
+        self.timer.lap('ensemble')
+
+        # %%
+        # Extra trees training and prediction
+        et = ExtraTreesClassifier(**self.etree_params)
+        et.fit(X_train,y_train) 
+        self.timer.lap('fit_ET')
+        y_predict=et.predict(X_test)
+        y_true=y_test
+        m=metrics.evaluate(y_true,y_predict)
+        metrics.print_summary('ET', m)
+        cm=m.cm
+        heatmap.plot_confusion_matrix(cm)
+        self.timer.lap('metrics')
+        et_f1 = m.f1
+
+        # %%
+        et_train=et.predict(X_train)
+        et_test=et.predict(X_test)
+        self.timer.lap('ensemble')
+
+        # %%
+        # XGboost training and prediction
+        xg = xgb.XGBClassifier(**self.xgb_params)
+        xg.fit(X_train,y_train)
+        self.timer.lap('fit_XGBoost')
+        y_predict=xg.predict(X_test)
+        y_true=y_test
+        m=metrics.evaluate(y_true,y_predict)
+        metrics.print_summary('XGBoost', m)
+        cm=m.cm
+        heatmap.plot_confusion_matrix(cm)
+        self.timer.lap('metrics')
+        xgb_f1 = m.f1
+
+        # %%
+        xg_train=xg.predict(X_train)
+        xg_test=xg.predict(X_test)
+        self.timer.lap('ensemble')
+
+        # %% [markdown]
+        # ### Stacking model construction (ensemble for 4 base learners)
+
+        # %%
+        # Use the outputs of 4 base models to construct a new ensemble model
+        base_predictions_train = pd.DataFrame( {
+            'DecisionTree': dt_train.ravel(),
+                'RandomForest': rf_train.ravel(),
+            'ExtraTrees': et_train.ravel(),
+            'XgBoost': xg_train.ravel(),
+            })
+        base_predictions_train.head(5)
+
+        # %%
+        dt_train=dt_train.reshape(-1, 1)
+        et_train=et_train.reshape(-1, 1)
+        rf_train=rf_train.reshape(-1, 1)
+        xg_train=xg_train.reshape(-1, 1)
+        dt_test=dt_test.reshape(-1, 1)
+        et_test=et_test.reshape(-1, 1)
+        rf_test=rf_test.reshape(-1, 1)
+        xg_test=xg_test.reshape(-1, 1)
+
+        # %%
+        x_train = np.concatenate(( dt_train, et_train, rf_train, xg_train), axis=1)
+        x_test = np.concatenate(( dt_test, et_test, rf_test, xg_test), axis=1)
+
+        # %%
+        stk = xgb.XGBClassifier().fit(x_train, y_train)
+        self.timer.lap('ensemble')
+
+        # %%
+        y_predict=stk.predict(x_test)
+        y_true=y_test
+        m=metrics.evaluate(y_true,y_predict)
+        metrics.print_summary('Stacking', m)
+        cm=m.cm
+        heatmap.plot_confusion_matrix(cm)
+        self.timer.lap('metrics')
+        self.dt, self.rf, self.et, self.xg = dt, rf, et, xg
+        return dt_f1, rt_f1, et_f1, xgb_f1
 
-    # %%
-    x_train = np.concatenate(( dt_train, et_train, rf_train, xg_train), axis=1)
-    x_test = np.concatenate(( dt_test, et_test, rf_test, xg_test), axis=1)
 
-    # %%
-    stk = xgb.XGBClassifier().fit(x_train, y_train)
-    y_predict=stk.predict(x_test)
-    y_true=y_test
-    stk_score=accuracy_score(y_true,y_predict)
-    print('Accuracy of Stacking: '+ str(stk_score))
-    precision,recall,fscore,none= precision_recall_fscore_support(y_true, y_predict, average='weighted') 
-    print('Precision of Stacking: '+(str(precision)))
-    print('Recall of Stacking: '+(str(recall)))
-    print('F1-score of Stacking: '+(str(fscore)))
-    print(classification_report(y_true,y_predict))
-    cm=confusion_matrix(y_true,y_predict)
-    f,ax=plt.subplots(figsize=(5,5))
-    sns.heatmap(cm,annot=True,linewidth=0.5,linecolor="red",fmt=".0f",ax=ax)
-    plt.xlabel("y_pred")
-    plt.ylabel("y_true")
-    #plt.show()
-    return str(stk_score), precision, recall, fscore, cm
+    # %% [markdown]
+    def feature_selection(self):
+        # ## Feature Selection
+        self.timer.reset()
+
+        # %% [markdown]
+        # ### Feature importance
+
+        # %%
+        # Save the feature importance lists generated by four tree-based algorithms
+        dt_feature = self.dt.feature_importances_
+        rf_feature = self.rf.feature_importances_
+        et_feature = self.et.feature_importances_
+        xgb_feature = self.xg.feature_importances_
+
+        # %%
+        # calculate the average importance value of each feature
+        avg_feature = (dt_feature + rf_feature + et_feature + xgb_feature)/4
+
+        # %%
+        feature=np.array(stage_cache.preparation(self.prepared).value['columns'])
+        print ("Features sorted by their score:")
+        print (sorted(zip(map(lambda x: round(x, 4), avg_feature), feature), reverse=True))
+
+        # %%
+        f_list = sorted(zip(map(lambda x: round(x, 4), avg_feature), feature), reverse=True)
+
+        # %%
+        len(f_list)
+
+        # %%
+        # Select the important features from top-importance to bottom-importance until the accumulated importance reaches 0.9 (out of 1)
+        Sum = 0
+        fs = []
+        for i in range(0, len(f_list)):
+            Sum = Sum + f_list[i][0]
+            fs.append(f_list[i][1])
+            if Sum>=0.9:
+                break        
+
+        # %%
+        self.timer.lap('feature_selection')
+        return self.split_and_oversample(fs)
+
+
+    def run(self):
+        X_train, X_test, y_train, y_test = self.preprocessing()
+        self.train_base(X_train, X_test, y_train, y_test)
+        X_train, X_test, y_train, y_test = self.feature_selection()
+        accuracy, precision, recall, f1, cm = train_after_feature_select(X_train, X_test, y_train, y_test, self.timer)
+        end_time = time.time()
+        run_model_time = end_time - self.start_time
+
+        return (str(run_model_time), accuracy, precision, recall, f1, str(cm.tolist()))
 
 # %%
 
-def run_model(data_path, xgb_params, dtree_params, rtree_params, etree_params):
-    X_train, X_test, y_train, y_test = preprocessing(data_path)
-    train_base(X_train, X_test, y_train, y_test, xgb_params, dtree_params, rtree_params, etree_params)
-    X_train, X_test, y_train, y_test = feature_selection()
-    accuracy, precision, recall, f1, cm = train_after_feature_select(X_train, X_test, y_train, y_test)
-    end_time = time.time()
-    run_model_time = end_time - start_time
-
-    return (str(run_model_time), accuracy, precision, recall, f1, str(cm.tolist()))
+def run_model(data_path, xgb_params, dtree_params, rtree_params, etree_params, compact=False):
+    return TreeBasedRun(data_path, xgb_params, dtree_params, rtree_params, etree_params, compact).run()
 
 #run_model()
 
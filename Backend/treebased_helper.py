@@ -2,6 +2,7 @@ from datetime import datetime
 import sqlite3
 import treebased
 import json
+import stage_timer
 import sqlalchemy
 from db_session import Session, engine
 from data_models import TreeBased, LCCDE
@@ -46,18 +47,23 @@ def run(json_req):
     path = './Backend/Intrusion-Detection-System-Using-Machine-Learning-main/data/'
     dataset_path = str(json_req["model_req"]["dataset_path"])
     dataset = path + dataset_path
+    #optional: keep features as float32 / labels as small ints during preprocessing
+    compact = json_req["model_req"].get("compact", False) in (True, 1, 'true', 'True', '1')
 
     #run model
-    result = treebased.run_model(dataset, xgb_params, dtree_params, rtree_params, etree_params)
+    tree_run = treebased.TreeBasedRun(dataset, xgb_params, dtree_params, rtree_params, etree_params, compact)
+    result = tree_run.run()
+    stage_timings = tree_run.timer.as_dict()
     # print(result)
 
     #create json
-    result_json = parse_to_json(result)
+    result_json = parse_to_json(result, stage_timings)
     # print('results')
     # print(result_json)
 
     #store results
-    record(result, xgb_params, dtree_params, rtree_params, etree_params, dataset_path)
+    run_id = record(result, xgb_params, dtree_params, rtree_params, etree_params, dataset_path)
+    stage_timer.record(run_id, 'TreeBased', stage_timings)
     
     return result_json
 
@@ -86,6 +92,7 @@ def get_runs():
     RT_keys = ['n_estimators', 'max_depth', 'min_samples_split']
     ET_keys = ['n_estimators', 'max_depth', 'min_samples_split']
 
+    timings = stage_timer.get_all('TreeBased')
     with Session.begin() as session:
         rows_dict = { "rows" : [] }
 
@@ -127,6 +134,8 @@ def get_runs():
             row_dict['ET_keys']['n_estimators'] = class_instance.etree_estimators
             row_dict['ET_keys']['max_depth'] = class_instance.etree_max_depth
             row_dict['ET_keys']['min_samples_split'] = class_instance.etree_min_samples
+
+            row_dict['stage_timings'] = timings.get(class_instance.run_id, {})
     #         # print(list(enumerate(keys)))
     #         for i, key in enumerate(keys):
     #             row_dict[key] = r[i]
@@ -182,16 +191,19 @@ def record(result, xgb_params, dtree_params, rtree_params, etree_params, dataset
         query = f'INSERT INTO TreeBased (duration, accuracy, prec, recall, f1_score, heatmap_data, xgb_estimators, xgb_max_depth, xgb_learning_rate, dtree_max_depth, dtree_min_samples, dtree_splitter, rtree_estimators, rtree_max_depth, rtree_min_samples, etree_estimators, etree_max_depth, etree_min_samples, run_date, dataset_path) VALUES ({rec_str})'
         print(query)
         session.execute(text(query))
+        #the insert trigger renumbers the row to the new RunHistory id
+        run_id = session.execute(text("SELECT MAX(run_id) FROM RunHistory")).scalar()
 
         session.commit()
         session.close()
+    return run_id
 
 # #read from db function? how are we searching
 # def read():
 #     pass
 
 #decode/parse json function?
-def parse_to_json(result):
+def parse_to_json(result, stage_timings=None):
     keys = ['execution_time', 'accuracy', 'precision', 'recall', 'f1', 'heatmap']
     json_result = {"model_results": {}}
 
@@ -200,6 +212,7 @@ def parse_to_json(result):
             json_result["model_results"][key] = None
         else:
             json_result["model_results"][key] = result[idx]
+    json_result["model_results"]["stage_timings"] = stage_timings
     
     json_result = json.dumps(json_result)
     return json_result
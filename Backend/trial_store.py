@@ -0,0 +1,82 @@
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+from hyperopt import pyll
+
+# Finished HPO trials of mth.py, kept across requests in a SQLite file.
+# Trials are filed under a context: a hash of the model family, the search space and the arrays the
+# search trains and scores on. The arrays stand for the dataset, the split and the selected features
+# (they are the stage_cache outputs, so a repeated /runMth on the same dataset sees the same arrays).
+# hpo.py uses the store two ways:
+# - a parameter set that was already evaluated in the context (hp.quniform spaces repeat themselves
+#   often) is answered from the store instead of fitting the model again
+# - a TPE search starts from every stored trial of its context, so a repeated search skips the random
+#   start-up trials and refines the earlier optimum
+# Only full-fidelity results are stored (not the subsample rungs of successive halving).
+# IDS_HPO_STORE=0 turns the store off.
+STORE_PATH = './Backend/hpo_trials.db'
+ENABLED = os.environ.get('IDS_HPO_STORE', '1') == '1'
+
+def connect():
+    connection = sqlite3.connect(STORE_PATH, timeout=60)
+    connection.execute("CREATE TABLE IF NOT EXISTS HpoTrials (context VARCHAR, params VARCHAR, point VARCHAR, loss FLOAT, "
+                       "created VARCHAR, PRIMARY KEY (context, params))")
+    return connection
+
+def context_key(family, space, arrays):
+    h = hashlib.sha256()
+    h.update(json.dumps({'family': family, 'space': str(pyll.as_apply(space))}).encode('utf-8'))
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(repr((a.shape, a.dtype.str)).encode('utf-8'))
+        h.update(a.data)
+    return h.hexdigest()
+
+def plain(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+#the parameters as the objective receives them, in a canonical form
+def params_key(params):
+    return json.dumps({k: plain(v) for k, v in params.items()}, sort_keys=True)
+
+#{params key: result} of the given parameter sets that are stored in the context
+def lookup(context, keys):
+    if not keys:
+        return {}
+    connection = connect()
+    c = connection.cursor()
+    found = {}
+    for key in set(keys):
+        c.execute("SELECT loss FROM HpoTrials WHERE context = ? AND params = ?", (context, key))
+        row = c.fetchone()
+        if row is not None:
+            found[key] = {'loss': row[0], 'status': 'ok'}
+    c.close()
+    connection.close()
+    return found
+
+#store (point, params, result) triples; point is hyperopt's index form of params
+def save(context, entries):
+    rows = [(context, params_key(params), json.dumps({k: plain(v) for k, v in point.items()}, sort_keys=True),
+             float(result['loss']), str(datetime.datetime.now()))
+            for point, params, result in entries if result.get('status') == 'ok']
+    if not rows:
+        return
+    connection = connect()
+    connection.executemany("INSERT OR IGNORE INTO HpoTrials (context, params, point, loss, created) VALUES (?, ?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+
+#[(point, loss)] of every stored trial of the context, oldest first
+def history(context):
+    connection = connect()
+    c = connection.cursor()
+    c.execute("SELECT point, loss FROM HpoTrials WHERE context = ? ORDER BY rowid", (context,))
+    rows = c.fetchall()
+    c.close()
+    connection.close()
+    return [(json.loads(point), loss) for point, loss in rows]